@@ -1,26 +1,31 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, request, make_response
+from quart_cors import cors
+import asyncio
+import functools
+import hashlib
+import inspect
+import orjson
 import os
+import redis.asyncio as aioredis
+import time
 from dotenv import load_dotenv
 from utils.chat_manager import ChatManager
-from utils.openai_research_client import GroqResearchClient
+from utils.research_client import make_research_client
 from utils.meal_planner import MealPlanner
-from datetime import datetime
-import random
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 # Configure CORS with explicit settings
-CORS(app, 
-     origins="*",
-     methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-     allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
-     expose_headers=["Content-Type"],
-     supports_credentials=False,
-     max_age=3600)
+app = cors(app,
+           allow_origin="*",
+           allow_methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
+           allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+           expose_headers=["Content-Type"],
+           allow_credentials=False,
+           max_age=3600)
 
 # Initialize managers
 print("\n" + "=" * 60)
@@ -32,252 +37,280 @@ groq_key = os.getenv('GROQ_API_KEY', '').strip()
 if groq_key:
     print(f"[INFO] ✅ GROQ_API_KEY found (length: {len(groq_key)})")
 else:
-    print(f"[WARNING] ⚠️  GROQ_API_KEY not found in environment")
+    print(f"[WARNING] ⚠️  GROQ_API_KEY not found in environment, using Perplexity for research")
     print(f"[INFO] 💡 Set GROQ_API_KEY in .env file to enable AI-generated meal plans")
     print(f"[INFO] 💡 Get your key from: https://console.groq.com/")
 
 chat_manager = ChatManager()
-research_client = GroqResearchClient()
-meal_planner = MealPlanner(research_client)  # Will be updated with session info per request
 print("=" * 60 + "\n")
 
+# Full meal plans are shared across workers and restarts when Redis is configured
+REDIS_URL = os.getenv('REDIS_URL', '').strip()
+MEAL_PLAN_CACHE_TTL = 24 * 3600
+
+
+_FINAL_MESSAGE_TEMPLATE = """Here's your personalized affordable meal plan! 🥗
+
+📊 **Weekly Summary**:
+- Total Cost: ${total_cost:.2f} CAD (under your ${budget} CAD budget - {budget_util} utilized)
+- Serves: {people} people
+- Location: {location}
+
+🛒 **Grocery List**: Ready for shopping
+📅 **Meal Plan**: 7 days of meals with recipes
+💡 **Tips**: Cooking and storage advice included
+
+Would you like any adjustments or have questions about your plan?"""
+
+
+def fast_json(obj, status=200):
+    """Serialize a response body with orjson"""
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+# LLM clients are created on first use so importing the app stays cheap
+@functools.cache
+def get_research_client():
+    """Get the shared ingredient research client"""
+    return make_research_client()
+
+
+@functools.cache
+def get_meal_planner():
+    """Get the shared meal planner"""
+    return MealPlanner(get_research_client())
+
+
+@functools.cache
+def get_redis():
+    """Get the shared Redis client, or None when caching is disabled"""
+    return aioredis.from_url(REDIS_URL) if REDIS_URL else None
+
+
+def _meal_plan_cache_key(user_data):
+    """Hash the canonical user data into a Redis key"""
+    digest = hashlib.sha256(orjson.dumps(user_data, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f"meal_plan:{digest}"
+
+
+async def _load_cached_meal_plan(user_data):
+    """Return a saved meal plan for these preferences, if any"""
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        cached = await redis.get(_meal_plan_cache_key(user_data))
+    except aioredis.RedisError as e:
+        print(f"[{time.strftime('%H:%M:%S')}] Meal plan cache read failed: {e}")
+        return None
+    return orjson.loads(cached) if cached else None
+
+
+async def _store_meal_plan(user_data, meal_plan):
+    """Save a generated meal plan for identical future requests"""
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        await redis.set(_meal_plan_cache_key(user_data), orjson.dumps(meal_plan), ex=MEAL_PLAN_CACHE_TTL)
+    except aioredis.RedisError as e:
+        print(f"[{time.strftime('%H:%M:%S')}] Meal plan cache write failed: {e}")
+
+
+@app.before_serving
+async def warm_up_clients():
+    """Pre-open pooled connections to the LLM providers"""
+    await asyncio.gather(*(
+        client.warm_up() for client in (chat_manager, get_research_client(), get_meal_planner())
+        if hasattr(client, 'warm_up')
+    ))
+
+
+@app.after_serving
+async def close_clients():
+    """Release pooled connections on shutdown"""
+    await chat_manager.aclose()
+    for getter in (get_research_client, get_meal_planner):
+        # Skip clients that were never created
+        if not getter.cache_info().currsize:
+            continue
+        client = getter()
+        if hasattr(client, 'aclose'):
+            await client.aclose()
+    
+    redis = get_redis() if get_redis.cache_info().currsize else None
+    if redis is not None:
+        await redis.aclose()
+
+
+async def run_async(func, *args):
+    """Await a coroutine function, or run a sync callable in a worker thread"""
+    if inspect.iscoroutinefunction(func):
+        return await func(*args)
+    return await asyncio.to_thread(func, *args)
+
 
 @app.route('/api/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'message': 'Server is running'}), 200
+    return fast_json({'status': 'ok', 'message': 'Server is running'})
 
 @app.route('/api/chat', methods=['POST', 'OPTIONS'])
-def chat():
+async def chat():
     """Main chat endpoint"""
     if request.method == 'OPTIONS':
-        response = jsonify({})
+        response = fast_json({})
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
         response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
         return response
     
     try:
-        data = request.json
+        data = await request.get_json()
         user_message = data.get('message', '')
         session_id = data.get('session_id', 'default')
         
-        # Get or create session
-        session = chat_manager.get_session(session_id)
-        
-        # Process message and get AI response
-        response = chat_manager.process_message(session_id, user_message)
+        # Get or create session, held in memory until this request finishes
+        session = await chat_manager.acquire_session(session_id)
         
-        # Check if we should trigger meal planning
-        if chat_manager.should_generate_meal_plan(session_id):
-            # Start meal planning process
-            user_data = session.get('user_data', {})
-            location = user_data.get('location', '')
-            budget = user_data.get('budget', 0)
-            people = user_data.get('people', 1)
-            
-            # Set status to processing immediately
-            session['status'] = 'processing'
+        try:
+            # Process message and get AI response
+            response = await chat_manager.process_message(session_id, user_message)
             
-            try:
-                # Research phase - add to activity log immediately
-                chat_manager.add_activity_log(session_id, f"🔍 Researching affordable food prices in {location}...")
-                
-                ingredients = research_client.research_ingredients(location, budget)
-                chat_manager.add_activity_log(session_id, f"✅ Found {len(ingredients)} affordable ingredients at local stores")
+            # Check if we should trigger meal planning
+            if chat_manager.should_generate_meal_plan(session_id):
+                # Start meal planning process
+                user_data = session.get('user_data', {})
+                location = user_data.get('location', '')
+                budget = user_data.get('budget', 0)
+                people = user_data.get('people', 1)
                 
-                # Meal planning phase - add to activity log immediately
-                chat_manager.add_activity_log(session_id, "📊 Analyzing budget constraints...")
-                chat_manager.add_activity_log(session_id, "📋 Creating your personalized grocery list and meal plan...")
+                # Set status to processing immediately
+                chat_manager.set_status(session_id, 'processing')
                 
-                # Update meal_planner with session info for real-time activity log updates
-                meal_planner.chat_manager = chat_manager
-                meal_planner.session_id = session_id
+                try:
+                    # A saved plan for identical preferences skips both LLM phases
+                    meal_plan = await _load_cached_meal_plan(user_data)
+                    if meal_plan is not None:
+                        chat_manager.add_activity_log(session_id, "⚡ Found a saved meal plan for your preferences")
+                    else:
+                        # Research phase - add to activity log immediately
+                        chat_manager.add_activity_log(session_id, f"🔍 Researching affordable food prices in {location}...")
+                        
+                        ingredients = await run_async(get_research_client().research_ingredients, location, budget)
+                        chat_manager.add_activity_log(session_id, f"✅ Found {len(ingredients)} affordable ingredients at local stores")
+                        
+                        # Meal planning phase - add to activity log immediately
+                        chat_manager.extend_activity_log(session_id, [
+                            "📊 Analyzing budget constraints...",
+                            "📋 Creating your personalized grocery list and meal plan..."
+                        ])
+                        
+                        # Generate meal plan (this will add its own activity log entries to session in real-time)
+                        meal_plan = await get_meal_planner().generate_meal_plan(
+                            user_data,
+                            ingredients,
+                            session.get('activity_log', [])  # Pass existing activity log
+                        )
+                        # A fallback only means generation failed this time, so don't pin it
+                        if not meal_plan.get('is_fallback'):
+                            await _store_meal_plan(user_data, meal_plan)
+                    
+                    # Format final response message
+                    weekly_summary = meal_plan.get('weekly_summary', {})
+                    total_cost = weekly_summary.get('total_cost', 0)
+                    budget_util = weekly_summary.get('budget_utilization', '0%')
+                    
+                    final_message = _FINAL_MESSAGE_TEMPLATE.format(
+                        total_cost=total_cost,
+                        budget=budget,
+                        budget_util=budget_util,
+                        people=people,
+                        location=location
+                    )
+                    
+                    # Add meal plan to session and mark as generated
+                    session['meal_plan'] = meal_plan
+                    session['meal_plan_generated'] = True
+                    chat_manager.set_status(session_id, 'complete')
+                    session['state'] = 'complete'
+                    
+                    response['meal_plan'] = meal_plan
+                    response['activity_log'] = chat_manager.render_activity_log(session_id)
+                    response['message'] = final_message
+                    
+                except Exception as e:
+                    chat_manager.add_activity_log(session_id, f"⚠️ Error: {str(e)}")
+                    chat_manager.set_status(session_id, 'error')
+                    response['activity_log'] = chat_manager.render_activity_log(session_id)
+                    response['error'] = str(e)
+                    response['status'] = 'error'
+                    response['message'] = f"I encountered an error while creating your meal plan. Please try again or contact support. Error: {str(e)}"
                 
-                # Generate meal plan (this will add its own activity log entries to session in real-time)
-                meal_plan = meal_planner.generate_meal_plan(
-                    user_data,
-                    ingredients,
-                    session.get('activity_log', [])  # Pass existing activity log
-                )
-                
-                # Format final response message
-                weekly_summary = meal_plan.get('weekly_summary', {})
-                total_cost = weekly_summary.get('total_cost', 0)
-                budget_util = weekly_summary.get('budget_utilization', '0%')
-                
-                final_message = f"""Here's your personalized affordable meal plan! 🥗
-
-📊 **Weekly Summary**:
-- Total Cost: ${total_cost:.2f} CAD (under your ${budget} CAD budget - {budget_util} utilized)
-- Serves: {people} people
-- Location: {location}
-
-🛒 **Grocery List**: Ready for shopping
-📅 **Meal Plan**: 7 days of meals with recipes
-💡 **Tips**: Cooking and storage advice included
-
-Would you like any adjustments or have questions about your plan?"""
-                
-                # Add meal plan to session and mark as generated
-                session['meal_plan'] = meal_plan
-                session['meal_plan_generated'] = True
-                session['status'] = 'complete'
-                session['state'] = 'complete'
-                
-                response['meal_plan'] = meal_plan
-                response['activity_log'] = session.get('activity_log', [])
-                response['message'] = final_message
-                
-            except Exception as e:
-                error_msg = f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Error: {str(e)}"
-                chat_manager.add_activity_log(session_id, error_msg)
-                session['status'] = 'error'
-                response['activity_log'] = session.get('activity_log', [])
-                response['error'] = str(e)
-                response['status'] = 'error'
-                response['message'] = f"I encountered an error while creating your meal plan. Please try again or contact support. Error: {str(e)}"
-        
-        return jsonify(response)
+                await chat_manager.save_session(session_id, session)
+            
+            return fast_json(response)
+        finally:
+            chat_manager.release_session(session_id)
     
     except Exception as e:
-        return jsonify({'error': str(e), 'message': 'An error occurred processing your request'}), 500
+        return fast_json({'error': str(e), 'message': 'An error occurred processing your request'}, status=500)
 
 @app.route('/api/activity_log', methods=['GET'])
-def get_activity_log():
+async def get_activity_log():
     """Get real-time activity updates"""
     session_id = request.args.get('session_id', 'default')
-    session = chat_manager.get_session(session_id)
-    return jsonify({
-        'activity_log': session.get('activity_log', []),
-        'status': session.get('status', 'idle')
-    })
-
-@app.route('/api/generate_meal_plan', methods=['POST'])
-
-def generate_meal_plan(self, user_data, ingredients, activity_log):
-    """
-    Generate a weekly meal plan and grocery list with correct field names for frontend.
-    """
+    session = await chat_manager.acquire_session(session_id)
     try:
-        location = user_data.get("location", "Canada")
-        budget = float(user_data.get("budget", 0))
-        people = int(user_data.get("people", 1))
-        diet = user_data.get("diet", "balanced")
-
-        activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] 🍳 Creating meal plan for {people} people in {location} ({diet} diet)...")
-
-        # --- Step 1: Build grocery list with correct field names ---
-        grocery_list = []
-        for item in ingredients:
-            try:
-                name = item.get("name", "Unknown Ingredient")
-                quantity = item.get("quantity", "1")
-                
-                # Use correct field names for frontend
-                estimated_cost = float(item.get("price", round(random.uniform(1.0, 10.0), 2)))
-                
-                grocery_list.append({
-                    "ingredient": name,  # Frontend expects this
-                    "quantity": quantity,
-                    "unit": "unit",  # Add unit field
-                    "estimated_cost": round(estimated_cost, 2),  # Frontend expects this
-                    "store": item.get("store", "Local Store"),
-                    "store_address": item.get("address", "Local Address")
-                })
-            except Exception as e:
-                activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Skipped ingredient due to error: {str(e)}")
-                continue
-
-        # --- Step 2: Calculate total grocery cost ---
-        total_grocery_cost = 0.0
-        for item in grocery_list:
-            try:
-                total_grocery_cost += float(item.get("estimated_cost", 0))
-            except Exception:
-                continue
-
-        total_grocery_cost = round(total_grocery_cost, 2)
-
-        # --- Step 3: Compute budget utilization ---
-        if budget > 0:
-            utilization = min((total_grocery_cost / budget) * 100, 100)
-            budget_utilization = f"{utilization:.1f}%"
-        else:
-            budget_utilization = "N/A"
-
-        # --- Step 4: Generate 7-day meal schedule ---
-        days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-        meal_schedule = []
-        for day in days:
-            meal_schedule.append({
-                "day": day,
-                "breakfast": f"Oatmeal with fruit ({diet})",
-                "lunch": f"Grilled chicken with veggies ({diet})",
-                "dinner": f"Rice bowl with mixed vegetables ({diet})"
-            })
-
-        # --- Step 5: Build output dictionary with correct field names ---
-        meal_plan = {
-            "weekly_summary": {
-                "total_cost": total_grocery_cost,  # Use same total as grocery list
-                "budget_utilization": budget_utilization,
-                "currency": "CAD",
-                "serves": people,
-                "location": location
-            },
-            "grocery_list": grocery_list,
-            "total_grocery_cost": total_grocery_cost,  # Add this for frontend
-            "meal_schedule": meal_schedule,
-            "tips": [
-                "Buy items in bulk for better prices.",
-                "Use seasonal produce for fresher and cheaper meals.",
-                "Cook in batches to save time and reduce waste."
-            ]
-        }
-
-        activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Meal plan created successfully! Total cost: ${total_grocery_cost:.2f} CAD")
-
-        return meal_plan
+        return fast_json({
+            'activity_log': chat_manager.render_activity_log(session_id),
+            'status': session.get('status', 'idle')
+        })
+    finally:
+        chat_manager.release_session(session_id)
 
-    except Exception as e:
-        error_msg = f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Error during meal plan generation: {str(e)}"
-        activity_log.append(error_msg)
-        return {
-            "weekly_summary": {
-                "total_cost": 0,
-                "budget_utilization": "0%",
-                "currency": "CAD",
-                "serves": user_data.get("people", 1),
-                "location": user_data.get("location", "Unknown")
-            },
-            "grocery_list": [],
-            "total_grocery_cost": 0,
-            "meal_schedule": [],
-            "tips": [],
-            "error": str(e)
-        }
+def _sse(event, data):
+    """Encode one Server-Sent Event with a JSON payload"""
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), orjson.dumps(data))
 
-    except Exception as e:
-        error_msg = f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Error during meal plan generation: {str(e)}"
-        activity_log.append(error_msg)
-        return {
-            "weekly_summary": {
-                "total_cost": 0,
-                "budget_utilization": "0%",
-                "currency": "CAD",
-                "serves": user_data.get("people", 1),
-                "location": user_data.get("location", "Unknown")
-            },
-            "grocery_list": [],
-            "total_grocery_cost": 0,
-            "meal_schedule": [],
-            "tips": [],
-            "error": str(e)
-        }
+@app.route('/api/activity_log/stream', methods=['GET'])
+async def stream_activity_log():
+    """Push activity updates as Server-Sent Events (polling endpoint kept for compatibility)"""
+    session_id = request.args.get('session_id', 'default')
+    
+    async def events():
+        # Held for the life of the stream so every request on this session shares its activity log;
+        # taken here so a body closed before it starts never pins the session
+        session = await chat_manager.acquire_session(session_id)
+        # Snapshot and subscribe without awaiting in between so no entry is missed
+        backlog = session['activity_log'].render()
+        queue = session['activity_log'].subscribe()
+        try:
+            yield _sse('snapshot', backlog)
+            yield _sse('status', session.get('status', 'idle'))
+            while True:
+                event, data = await queue.get()
+                yield _sse(event, data)
+        finally:
+            # The subscription follows the session if it was reloaded meanwhile
+            chat_manager.get_session(session_id)['activity_log'].unsubscribe(queue)
+            chat_manager.release_session(session_id)
+    
+    response = await make_response(events(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None
+    return response
 
 if __name__ == '__main__':
     import socket
+    import uvicorn
     
     # Get local IP address for network access
     def get_local_ip():
@@ -292,15 +325,28 @@ if __name__ == '__main__':
             return "127.0.0.1"
     
     local_ip = get_local_ip()
+    # Each turn saves its session to SQLite, so a later request on another worker
+    # starts from the last saved state. Concurrent turns on one session can still
+    # overwrite each other, and live activity streams and in-flight meal plan
+    # coalescing are per process, so scaling out is opt-in
+    workers = int(os.getenv('WEB_CONCURRENCY', '1'))
     
     print("\n" + "=" * 60)
     print("BACKEND SERVER")
     print("=" * 60)
-    print("Status: Starting Flask Backend Server")
+    print("Status: Starting Quart Backend Server (uvicorn + uvloop)")
     print("Local:  http://localhost:5001")
     print(f"Network: http://{local_ip}:5001")
     print("Host:   0.0.0.0 (accessible on all interfaces)")
-    print("Mode:   Debug")
+    print(f"Workers: {workers}")
     print("CORS:   Enabled for all origins")
     print("=" * 60 + "\n")
-    app.run(debug=True, port=5001, host='0.0.0.0')
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=5001,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        log_level="info"
+    )
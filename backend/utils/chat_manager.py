@@ -1,48 +1,340 @@
+import asyncio
+import functools
+import httpx
 import openai
+import orjson
 import os
-from typing import Dict, List
-from datetime import datetime
+import re
+import time
+from cachetools import LRUCache
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from utils.session_store import SessionStore
+
+# Maximum activity log entries kept per session (oldest are dropped first)
+ACTIVITY_LOG_SIZE = 256
+# SQLite file backing the session store, and how many sessions stay in memory
+SESSION_DB = os.getenv('SESSION_DB', 'sessions.db')
+SESSION_CACHE_SIZE = 1024
+# Generated missing-field prompts kept for reuse
+PROMPT_CACHE_SIZE = 512
+
+
+class _LazyPattern:
+    """Regex compiled on first use, so sessions that never send details skip the cost"""
+    __slots__ = ('_source', '_compiled')
+    
+    def __init__(self, source: str):
+        self._source = source
+        self._compiled = None
+    
+    def get(self) -> re.Pattern:
+        if self._compiled is None:
+            self._compiled = re.compile(self._source)
+        return self._compiled
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+# Extraction patterns, each compiled the first time it is used
+_DIGIT_RUN = _LazyPattern(r'\d+')
+_PEOPLE_PATTERNS = tuple(_LazyPattern(p) for p in (
+    r'(\d+)\s*(?:people|person|persons|household|members)',
+    r'(?:household|family|feeding|serving).*?(\d+)',
+    r'(\d+)\s*(?:people|person)',
+))
+# Words and suffixes the budget scanner looks for around an amount
+_BUDGET_KEYWORDS = ('budget', 'spend', 'afford')
+_BUDGET_CONTEXT_WORDS = ('budget', 'spend', 'afford', 'cost', 'weekly', 'week')
+_DOLLAR_SUFFIXES = ('cad', 'usd', 'per week', 'weekly', 'a week', 'budget')
+_CURRENCY_SUFFIXES = ('cad', 'usd', 'dollar')
+_LOCATION_PATTERNS = tuple(_LazyPattern(p) for p in (
+    r'(?:in|at|location:?|shopping in)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)',
+    r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s*(?:city|area)',
+))
+_DIETARY_KEYWORDS = {
+    'vegetarian': ['vegetarian', 'veggie'],
+    'vegan': ['vegan'],
+    'gluten-free': ['gluten-free', 'gluten free', 'celiac'],
+    'lactose-intolerant': ['lactose', 'dairy-free', 'dairy free'],
+    'nut-free': ['nut-free', 'nut free', 'peanut'],
+    'halal': ['halal'],
+    'kosher': ['kosher'],
+    'pescatarian': ['pescatarian', 'pescetarian'],
+}
+# One capture group per category, so match.lastindex identifies the restriction
+_DIETARY_CATEGORIES = tuple(_DIETARY_KEYWORDS)
+_DIETARY_PATTERN = _LazyPattern('|'.join(
+    '(' + '|'.join(re.escape(keyword) for keyword in keywords) + ')'
+    for keywords in _DIETARY_KEYWORDS.values()
+))
+# System prompt for structured extraction when an API key is available
+_EXTRACTION_PROMPT = f"""Extract the user's meal planning details from their message and return a JSON object with these keys:
+people (integer or null), budget (weekly food budget as a number or null), location (city name or null),
+dietary_restrictions (list using only: {', '.join(_DIETARY_CATEGORIES)}), preferences (short text or null).
+Use null or an empty list for anything the message does not state."""
+# Fixed replies recognised by the conversation flow
+_START_WORDS = frozenset({'get started', 'start', 'hello', 'hi', 'begin'})
+_YES_WORDS = frozenset({'yes', 'y', 'correct', 'yeah', 'sure', 'ok', 'okay', 'confirmed'})
+_NO_WORDS = frozenset({'no', 'n', 'incorrect', 'wrong', 'change'})
+_PREFERENCE_PATTERNS = tuple(_LazyPattern(p) for p in (
+    r'(?:like|love|prefer|favorite|favourite)\s+(.+?)(?:\.|,|$)',
+    r'prefer\s+(.+?)\s+over',
+))
+
+
+@functools.lru_cache(maxsize=ACTIVITY_LOG_SIZE)
+def _clock(second: int) -> str:
+    """HH:MM:SS for an epoch second, formatted once per distinct second"""
+    return time.strftime('%H:%M:%S', time.localtime(second))
+
+
+def _amount_end(text: str, end: int) -> int:
+    """Extend a digit run ending at `end` over an optional two-digit decimal part"""
+    cents = text[end + 1:end + 3]
+    if text[end:end + 1] == '.' and len(cents) == 2 and cents.isdecimal():
+        return end + 3
+    return end
+
+
+def _skip_space(text: str, pos: int) -> int:
+    n = len(text)
+    while pos < n and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _find_dollar_amount(text: str, pos: int = 0) -> int:
+    """Index of the next '$' directly followed by a digit, or -1"""
+    dollar = text.find('$', pos)
+    while dollar != -1 and not text[dollar + 1:dollar + 2].isdecimal():
+        dollar = text.find('$', dollar + 1)
+    return dollar
+
+
+class ActivityLog(deque):
+    """Bounded log of (epoch seconds, message) entries that pushes updates to live stream subscribers"""
+    
+    def __init__(self, maxlen: int = ACTIVITY_LOG_SIZE):
+        super().__init__(maxlen=maxlen)
+        self._subscribers: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+    
+    @staticmethod
+    def format_entry(entry: Tuple[float, str]) -> str:
+        """Render one entry as "[HH:MM:SS] message" """
+        ts, message = entry
+        return f"[{_clock(int(ts))}] {message}"
+    
+    def render(self) -> List[str]:
+        """Format the stored entries for display"""
+        return [self.format_entry(entry) for entry in tuple(self)]
+    
+    def subscribe(self) -> asyncio.Queue:
+        """Return a queue that receives (event, data) pairs from now on"""
+        queue = asyncio.Queue()
+        self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        """Stop delivering updates to a queue"""
+        self._subscribers.pop(queue, None)
+    
+    def publish(self, event: str, data):
+        """Deliver an update to every subscriber (safe from worker threads)"""
+        for queue, loop in tuple(self._subscribers.items()):
+            loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+    
+    def append(self, entry: Tuple[float, str]):
+        super().append(entry)
+        if self._subscribers:
+            self.publish('log', self.format_entry(entry))
+    
+    def extend(self, entries):
+        entries = list(entries)
+        super().extend(entries)
+        if self._subscribers:
+            self.publish('logs', [self.format_entry(entry) for entry in entries])
+    
+    def adopt_subscribers(self, other: 'ActivityLog'):
+        """Take over another log's subscribers, e.g. when a session is reloaded from storage"""
+        self._subscribers.update(other._subscribers)
+        other._subscribers.clear()
+
+
+# Conversation roles stored as one byte each
+_ROLE_NAMES = ('user', 'assistant', 'system')
+_ROLE_CODES = {name: code for code, name in enumerate(_ROLE_NAMES)}
+
+
+class ConversationHistory:
+    """Chat turns kept as parallel role/content arrays; message dicts are built only for API calls"""
+    __slots__ = ('roles', 'contents')
+    
+    def __init__(self):
+        self.roles = bytearray()
+        self.contents: List[str] = []
+    
+    def __len__(self) -> int:
+        return len(self.contents)
+    
+    def append(self, role: str, content: str):
+        self.roles.append(_ROLE_CODES[role])
+        self.contents.append(content)
+    
+    def clear(self):
+        self.roles.clear()
+        self.contents.clear()
+    
+    def recent(self, count: int) -> List[Dict]:
+        """Last `count` turns as chat completion messages"""
+        return [{'role': _ROLE_NAMES[role], 'content': content}
+                for role, content in zip(self.roles[-count:], self.contents[-count:])]
+
+
+def _encode_session_value(obj):
+    if isinstance(obj, ConversationHistory):
+        return {'roles': list(obj.roles), 'contents': obj.contents}
+    if isinstance(obj, ActivityLog):
+        return list(obj)
+    raise TypeError
+
+
+def _dump_session(session: Dict) -> bytes:
+    return orjson.dumps(session, default=_encode_session_value, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _load_session(data: bytes) -> Dict:
+    session = orjson.loads(data)
+    history = ConversationHistory()
+    history.roles.extend(session['conversation_history']['roles'])
+    history.contents.extend(session['conversation_history']['contents'])
+    activity_log = ActivityLog()
+    activity_log.extend(map(tuple, session['activity_log']))
+    session['conversation_history'] = history
+    session['activity_log'] = activity_log
+    return session
+
 
 class ChatManager:
     def __init__(self):
-        self.sessions: Dict[str, Dict] = {}
+        self.sessions = SessionStore(SESSION_DB, _dump_session, _load_session, cache_size=SESSION_CACHE_SIZE)
         api_key = os.getenv('OPENAI_API_KEY')
-        self.openai_client = openai.OpenAI(api_key=api_key) if api_key else None
+        # Pooled HTTP/2 client so chat turns reuse a warm TLS connection
+        self._http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=30.0),
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
+        self.openai_client = openai.AsyncOpenAI(api_key=api_key, http_client=self._http) if api_key else None
         self.test_mode = os.getenv('TEST_MODE', 'false').lower() == 'true' or not api_key
+        # Dynamic prompts keyed on (field, known context), shared across sessions
+        self._prompt_cache = LRUCache(maxsize=PROMPT_CACHE_SIZE)
+        # Message handler per conversation state; other states fall back to _handle_general
+        self._handlers = {
+            'welcome': self._handle_welcome,
+            'collecting_info': self._handle_collecting_info,
+            'confirm': self._handle_confirm
+        }
+    
+    async def warm_up(self):
+        """Open a connection to the OpenAI API ahead of the first chat turn"""
+        if not self.openai_client:
+            return
+        try:
+            await self._http.head(str(self.openai_client.base_url))
+        except httpx.HTTPError as e:
+            print(f"[{time.strftime('%H:%M:%S')}] OpenAI warm-up failed: {e}")
+    
+    async def aclose(self):
+        """Close pooled connections and the session store"""
+        await self._http.aclose()
+        self.sessions.close()
+    
+    async def acquire_session(self, session_id: str) -> Dict:
+        """Load or create a session for one request or stream; pair with release_session"""
+        previous = self.sessions.peek(session_id)
+        # The only database read of the request, where saves by other workers are picked up
+        session = await asyncio.to_thread(self.sessions.get, session_id, self._new_session, True)
+        if previous is not None and previous is not session:
+            # Reloaded copy; move live streams over so they keep receiving updates
+            session['activity_log'].adopt_subscribers(previous['activity_log'])
+        return session
+    
+    def release_session(self, session_id: str):
+        """Let an acquired session be evicted from memory again"""
+        self.sessions.unpin(session_id)
     
     def get_session(self, session_id: str) -> Dict:
-        """Get or create a session"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {
-                'state': 'welcome',
-                'user_data': {},
-                'conversation_history': [],
-                'activity_log': [],
-                'status': 'idle'
-            }
-        return self.sessions[session_id]
+        """In-memory copy of a session acquired by the current request"""
+        return self.sessions.peek(session_id)
+    
+    async def save_session(self, session_id: str, session: Dict):
+        """Persist a session so other workers see its latest state"""
+        previous = self.sessions.peek(session_id)
+        # Encode on the event loop so the snapshot can't change mid-write
+        data = _dump_session(session)
+        await asyncio.to_thread(self.sessions.put, session_id, session, data)
+        if previous is not None and previous is not session:
+            # This copy becomes current again, so live streams follow it back
+            session['activity_log'].adopt_subscribers(previous['activity_log'])
+    
+    @staticmethod
+    def _new_session() -> Dict:
+        """Fresh session for a new conversation"""
+        return {
+            'state': 'welcome',
+            'user_data': {},
+            'conversation_history': ConversationHistory(),
+            'activity_log': ActivityLog(),
+            'status': 'idle'
+        }
     
     def add_activity_log(self, session_id: str, message: str):
         """Add timestamped activity log entry"""
         session = self.get_session(session_id)
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] {message}"
-        session['activity_log'].append(log_entry)
-        return log_entry
+        session['activity_log'].append((time.time(), message))
+    
+    def extend_activity_log(self, session_id: str, messages: List[str]):
+        """Add several entries sharing one timestamp in a single write"""
+        session = self.get_session(session_id)
+        now = time.time()
+        session['activity_log'].extend((now, message) for message in messages)
+    
+    def render_activity_log(self, session_id: str) -> List[str]:
+        """Format a session's activity log for display"""
+        return self.get_session(session_id)['activity_log'].render()
     
-    def process_message(self, session_id: str, user_message: str) -> Dict:
+    def set_status(self, session_id: str, status: str):
+        """Update session status and notify activity log subscribers"""
+        session = self.get_session(session_id)
+        session['status'] = status
+        session['activity_log'].publish('status', status)
+    
+    async def process_message(self, session_id: str, user_message: str) -> Dict:
         """Process user message and return AI response"""
         session = self.get_session(session_id)
         state = session['state']
-        user_data = session.get('user_data', {})
         
         # Add user message to history
-        session['conversation_history'].append({'role': 'user', 'content': user_message})
+        session['conversation_history'].append('user', user_message)
         
-        # Handle initial greeting
-        if state == 'welcome' and user_message.lower() in ['get started', 'start', 'hello', 'hi', 'begin']:
-            session['state'] = 'collecting_info'
-            welcome_message = """Welcome to NutriBudget AI! 🍎
+        handler = self._handlers.get(state, self._handle_general)
+        response = await handler(session_id, session, user_message)
+        
+        # Prompts for missing details are not kept in the history
+        if state != 'collecting_info':
+            session['conversation_history'].append('assistant', response['message'])
+        await self.save_session(session_id, session)
+        return response
+    
+    async def _handle_welcome(self, session_id: str, session: Dict, user_message: str) -> Dict:
+        """Handle initial greeting"""
+        if user_message.strip().lower() not in _START_WORDS:
+            return await self._handle_general(session_id, session, user_message)
+        
+        session['state'] = 'collecting_info'
+        welcome_message = """Welcome to NutriBudget AI! 🍎
 
 I'm here to help you create a personalized, affordable meal plan tailored to your family's needs and budget.
 
@@ -61,182 +353,194 @@ To get started, I'll need the following information:
    Any allergies, dietary restrictions, or food preferences? (e.g., "vegetarian", "no shellfish", "prefer chicken")
 
 Please provide all this information in your response, and I'll create a customized meal plan just for you!"""
-            
-            response = {
-                'message': welcome_message,
-                'state': 'collecting_info',
-                'user_data': user_data
-            }
-            session['conversation_history'].append({'role': 'assistant', 'content': welcome_message})
-            return response
         
-        # Extract all information from user message
-        if state == 'collecting_info':
+        return {
+            'message': welcome_message,
+            'state': 'collecting_info',
+            'user_data': session.get('user_data', {})
+        }
+    
+    async def _handle_collecting_info(self, session_id: str, session: Dict, user_message: str) -> Dict:
+        """Extract all information from user message"""
+        user_data = session.get('user_data', {})
+        extracted_data = None
+        if not self.test_mode and self.openai_client:
+            extracted_data = await self._extract_via_llm(user_message, user_data)
+        if extracted_data is None:
             extracted_data = self._extract_user_data(user_message, user_data)
-            
-            # Check what's missing
-            missing_fields = self._check_missing_fields(extracted_data)
-            
-            if missing_fields:
-                # Ask for missing information with helpful context
-                missing_text = ", ".join(missing_fields)
-                if len(missing_fields) == 1:
-                    field = missing_fields[0]
-                    # Use dynamic prompt with static fallback
-                    prompt_message = self._get_dynamic_prompt(field, extracted_data, session.get('conversation_history', []))
-                    response = {
-                        'message': prompt_message,
-                        'state': 'collecting_info',
-                        'user_data': extracted_data
-                    }
-                else:
-                    response = {
-                        'message': f"I'm still missing: {missing_text}. Could you provide these details?",
-                        'state': 'collecting_info',
-                        'user_data': extracted_data
-                    }
-            else:
-                # All info collected, show confirmation
-                # Double-check that budget is actually provided (not just a number)
-                if not extracted_data.get('budget'):
-                    # Use dynamic prompt with static fallback
-                    prompt_message = self._get_dynamic_prompt('Weekly budget', extracted_data, session.get('conversation_history', []))
-                    response = {
-                        'message': prompt_message,
-                        'state': 'collecting_info',
-                        'user_data': extracted_data
-                    }
-                else:
-                    session['user_data'] = extracted_data
-                    session['state'] = 'confirm'
-                    response = self._generate_confirmation(extracted_data)
-                    response['state'] = 'confirm'
-            
-            session['user_data'] = extracted_data
-            return response
-        
-        # Handle confirmation
-        elif state == 'confirm':
-            if user_message.lower() in ['yes', 'y', 'correct', 'yeah', 'sure', 'ok', 'okay', 'confirmed']:
-                session['state'] = 'processing'
-                self.add_activity_log(session_id, "🤖 Collecting user preferences... ✓")
-                
+        
+        # Check what's missing
+        missing_fields = self._check_missing_fields(extracted_data)
+        
+        if missing_fields:
+            # Ask for missing information with helpful context
+            missing_text = ", ".join(missing_fields)
+            if len(missing_fields) == 1:
+                field = missing_fields[0]
+                # Use dynamic prompt with static fallback
+                prompt_message = await self._get_dynamic_prompt(field, extracted_data, session['conversation_history'])
                 response = {
-                    'message': "Perfect! Let me research the best affordable ingredients in your area and create your personalized meal plan. This will take just a moment...",
-                    'state': 'processing',
-                    'user_data': user_data,
-                    'ready_for_meal_plan': True
+                    'message': prompt_message,
+                    'state': 'collecting_info',
+                    'user_data': extracted_data
                 }
-            elif user_message.lower() in ['no', 'n', 'incorrect', 'wrong', 'change']:
-                # Reset to collecting info
-                session['state'] = 'collecting_info'
-                session['user_data'] = {}
+            else:
                 response = {
-                    'message': "No problem! Let's start over. Please provide:\n\n1. **Household Size** - How many people?\n2. **Weekly Budget** - Amount (e.g., $100)\n3. **Location** - Which city?\n4. **Dietary Restrictions/Preferences** - Any allergies or preferences?",
+                    'message': f"I'm still missing: {missing_text}. Could you provide these details?",
                     'state': 'collecting_info',
-                    'user_data': {},
-                    'reset': True
+                    'user_data': extracted_data
                 }
-            else:
-                # Ask for clarification
+        else:
+            # All info collected, show confirmation
+            # Double-check that budget is actually provided (not just a number)
+            if not extracted_data.get('budget'):
+                # Use dynamic prompt with static fallback
+                prompt_message = await self._get_dynamic_prompt('Weekly budget', extracted_data, session['conversation_history'])
                 response = {
-                    'message': "Please confirm: Is the information correct? (Yes/No)",
-                    'state': 'confirm',
-                    'user_data': user_data
+                    'message': prompt_message,
+                    'state': 'collecting_info',
+                    'user_data': extracted_data
                 }
+            else:
+                session['user_data'] = extracted_data
+                session['state'] = 'confirm'
+                response = self._generate_confirmation(extracted_data)
+                response['state'] = 'confirm'
         
+        session['user_data'] = extracted_data
+        return response
+    
+    async def _handle_confirm(self, session_id: str, session: Dict, user_message: str) -> Dict:
+        """Handle confirmation"""
+        user_data = session.get('user_data', {})
+        reply = user_message.strip().lower()
+        
+        if reply in _YES_WORDS:
+            session['state'] = 'processing'
+            self.add_activity_log(session_id, "🤖 Collecting user preferences... ✓")
+            
+            response = {
+                'message': "Perfect! Let me research the best affordable ingredients in your area and create your personalized meal plan. This will take just a moment...",
+                'state': 'processing',
+                'user_data': user_data,
+                'ready_for_meal_plan': True
+            }
+        elif reply in _NO_WORDS:
+            # Reset to collecting info
+            session['state'] = 'collecting_info'
+            session['user_data'] = {}
+            response = {
+                'message': "No problem! Let's start over. Please provide:\n\n1. **Household Size** - How many people?\n2. **Weekly Budget** - Amount (e.g., $100)\n3. **Location** - Which city?\n4. **Dietary Restrictions/Preferences** - Any allergies or preferences?",
+                'state': 'collecting_info',
+                'user_data': {},
+                'reset': True
+            }
         else:
-            # Use GPT for general conversation or corrections
-            response = self._get_gpt_response(session['conversation_history'], user_data)
-            response['state'] = state
-            response['user_data'] = user_data
+            # Ask for clarification
+            response = {
+                'message': "Please confirm: Is the information correct? (Yes/No)",
+                'state': 'confirm',
+                'user_data': user_data
+            }
         
-        session['conversation_history'].append({'role': 'assistant', 'content': response['message']})
         return response
     
+    async def _handle_general(self, session_id: str, session: Dict, user_message: str) -> Dict:
+        """Use GPT for general conversation or corrections"""
+        user_data = session.get('user_data', {})
+        response = await self._get_gpt_response(session['conversation_history'], user_data)
+        response['state'] = session['state']
+        response['user_data'] = user_data
+        return response
+    
+    async def _extract_via_llm(self, text: str, existing_data: Dict) -> Optional[Dict]:
+        """Extract user data with one JSON-mode completion, or None to fall back to regex extraction"""
+        try:
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": _EXTRACTION_PROMPT},
+                    {"role": "user", "content": text}
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=200,
+                temperature=0
+            )
+            extracted = orjson.loads(response.choices[0].message.content)
+        except Exception as e:
+            print(f"[{time.strftime('%H:%M:%S')}] LLM extraction failed: {e}, using regex fallback")
+            return None
+        
+        if not isinstance(extracted, dict):
+            return None
+        
+        # Apply the same sanity ranges as the regex path
+        data = existing_data.copy()
+        people = extracted.get('people')
+        if isinstance(people, (int, float)) and not isinstance(people, bool) and 1 <= people <= 20:
+            data['people'] = int(people)
+        budget = extracted.get('budget')
+        if isinstance(budget, (int, float)) and not isinstance(budget, bool) and 10 <= budget <= 10000:
+            data['budget'] = float(budget)
+        location = extracted.get('location')
+        if isinstance(location, str) and location.strip():
+            data['location'] = location.strip()
+        
+        restrictions = list(data.get('dietary_restrictions', []))
+        for restriction in extracted.get('dietary_restrictions') or ():
+            if restriction in _DIETARY_KEYWORDS and restriction not in restrictions:
+                restrictions.append(restriction)
+        data['dietary_restrictions'] = restrictions
+        
+        preferences = extracted.get('preferences')
+        if isinstance(preferences, str) and preferences.strip():
+            data['preferences'] = f"{data.get('preferences', '')} {preferences.strip()}".strip()
+        
+        return data
+    
     def _extract_user_data(self, text: str, existing_data: Dict) -> Dict:
         """Extract all user data from text"""
-        import re
-        
         data = existing_data.copy()
         text_lower = text.lower()
         text_original = text
         
+        # Cheap C-level prechecks: every numeric pattern needs a digit, and the
+        # dollar patterns need a '$', so skip the regex scans when they can't match
+        has_digit = _DIGIT_RUN.search(text_lower) is not None
+        has_dollar = '$' in text_lower
+        has_budget_kw = 'budget' in text_lower
+        # Keyword flags for the preference checks, each substring scanned once
+        has_prefer = 'prefer' in text_lower
+        has_like = 'like' in text_lower
+        has_favorite = 'favorite' in text_lower
+        has_pref_kw = has_prefer or has_like or has_favorite or 'love' in text_lower or 'favourite' in text_lower
+        declines = ('no preferences' in text_lower or 'no dietary' in text_lower
+                    or ('no' in text_lower and 'allergies' in text_lower))
+        
         # Extract household size FIRST (to avoid confusion with budget)
         # Look for explicit patterns with "people", "person", "household"
-        people_patterns = [
-            r'(\d+)\s*(?:people|person|persons|household|members)',
-            r'(?:household|family|feeding|serving).*?(\d+)',
-            r'(\d+)\s*(?:people|person)',
-        ]
-        for pattern in people_patterns:
-            matches = re.findall(pattern, text_lower)
-            if matches:
-                num = int(matches[0])
+        # (only the first match of each pattern is used, so search rather than findall)
+        for pattern in (_PEOPLE_PATTERNS if has_digit else ()):
+            match = pattern.search(text_lower)
+            if match:
+                num = int(match.group(1))
                 if 1 <= num <= 20:  # Reasonable household size
                     data['people'] = num
                     break
         
         # Extract budget - ONLY when explicitly mentioned
         # Be very strict to avoid extracting random numbers
-        budget_found = False
-        
-        # Pattern 1: Explicit budget mentions with dollar amounts
-        budget_explicit = re.search(r'budget.*?\$?\s*(\d+(?:\.\d{2})?)\s*(?:cad|usd|dollar|dollars|per week|weekly|a week)?', text_lower)
-        if budget_explicit:
-            budget_value = float(budget_explicit.group(1))
-            if 10 <= budget_value <= 10000:
-                data['budget'] = budget_value
-                budget_found = True
-        
-        # Pattern 2: Dollar sign with number (only if "budget" keyword is nearby)
-        if not budget_found:
-            # Check if "budget" appears near a dollar amount
-            budget_near_dollar = re.search(r'(?:budget|spend|afford).*?\$(\d+(?:\.\d{2})?)', text_lower)
-            if budget_near_dollar:
-                budget_value = float(budget_near_dollar.group(1))
-                if 10 <= budget_value <= 10000:
-                    data['budget'] = budget_value
-                    budget_found = True
-        
-        # Pattern 3: Dollar sign at start of sentence or after budget keywords
-        if not budget_found:
-            # Look for "$X" pattern but only if it's clearly a budget context
-            dollar_pattern = re.search(r'\$(\d+(?:\.\d{2})?)\s*(?:cad|usd|per week|weekly|a week|budget)?', text_lower)
-            if dollar_pattern:
-                # Additional check: must have budget context words nearby
-                budget_context_words = ['budget', 'spend', 'afford', 'cost', 'weekly', 'week']
-                text_before = text_lower[max(0, dollar_pattern.start()-20):dollar_pattern.start()]
-                text_after = text_lower[dollar_pattern.end():min(len(text_lower), dollar_pattern.end()+20)]
-                context_text = text_before + text_after
-                if any(word in context_text for word in budget_context_words):
-                    budget_value = float(dollar_pattern.group(1))
-                    if 10 <= budget_value <= 10000:
-                        data['budget'] = budget_value
-                        budget_found = True
-        
-        # Pattern 4: Number with currency or time period (only with explicit budget context)
-        if not budget_found:
-            # "100 CAD" or "100 dollars" but only if "budget" is mentioned
-            if 'budget' in text_lower:
-                currency_pattern = re.search(r'(\d+(?:\.\d{2})?)\s*(?:cad|usd|dollar|dollars)', text_lower)
-                if currency_pattern:
-                    budget_value = float(currency_pattern.group(1))
-                    if 10 <= budget_value <= 10000:
-                        data['budget'] = budget_value
-                        budget_found = True
+        budget = self._extract_budget(text_lower, has_digit, has_dollar, has_budget_kw)
+        if budget is not None:
+            data['budget'] = budget
         
         # Extract location (city name)
         # Common patterns: "in {city}", "location: {city}", "{city}", "shopping in {city}"
-        location_patterns = [
-            r'(?:in|at|location:?|shopping in)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)',
-            r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s*(?:city|area)',
-        ]
-        for pattern in location_patterns:
-            matches = re.findall(pattern, text)
-            if matches:
+        for pattern in _LOCATION_PATTERNS:
+            match = pattern.search(text)
+            if match:
                 # Filter out common words that aren't cities
-                city = matches[0].strip()
+                city = match.group(1).strip()
                 if city.lower() not in ['the', 'and', 'or', 'for', 'with']:
                     data['location'] = city
                     break
@@ -251,47 +555,32 @@ Please provide all this information in your response, and I'll create a customiz
                         data['location'] = word
                         break
         
-        # Extract dietary preferences and restrictions
-        dietary_keywords = {
-            'vegetarian': ['vegetarian', 'veggie'],
-            'vegan': ['vegan'],
-            'gluten-free': ['gluten-free', 'gluten free', 'celiac'],
-            'lactose-intolerant': ['lactose', 'dairy-free', 'dairy free'],
-            'nut-free': ['nut-free', 'nut free', 'peanut'],
-            'halal': ['halal'],
-            'kosher': ['kosher'],
-            'pescatarian': ['pescatarian', 'pescetarian'],
-        }
-        
+        # Extract dietary preferences and restrictions in a single scan
         restrictions = data.get('dietary_restrictions', [])
         preferences = data.get('preferences', '')
         
-        for restriction, keywords in dietary_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                if restriction not in restrictions:
-                    restrictions.append(restriction)
+        found = {_DIETARY_CATEGORIES[m.lastindex - 1] for m in _DIETARY_PATTERN.finditer(text_lower)}
+        for restriction in _DIETARY_CATEGORIES:
+            if restriction in found and restriction not in restrictions:
+                restrictions.append(restriction)
         
         data['dietary_restrictions'] = restrictions
         
         # Extract food preferences (favorites, likes)
-        preference_patterns = [
-            r'(?:like|love|prefer|favorite|favourite)\s+(.+?)(?:\.|,|$)',
-            r'prefer\s+(.+?)\s+over',
-        ]
-        for pattern in preference_patterns:
-            matches = re.findall(pattern, text_lower)
-            if matches:
-                preferences += ' ' + matches[0]
+        for pattern in (_PREFERENCE_PATTERNS if has_pref_kw else ()):
+            match = pattern.search(text_lower)
+            if match:
+                preferences += ' ' + match.group(1)
         
         if preferences.strip():
             data['preferences'] = preferences.strip()
-        elif 'prefer' in text_lower or 'like' in text_lower or 'favorite' in text_lower:
+        elif has_prefer or has_like or has_favorite:
             # User mentioned preferences but we couldn't extract, keep existing or mark as present
             if not data.get('preferences'):
                 data['preferences'] = text  # Store full text as fallback
         
         # Handle "none" or "no" responses
-        if 'no preferences' in text_lower or 'no dietary' in text_lower or ('no' in text_lower and 'allergies' in text_lower):
+        if declines:
             if not data.get('dietary_restrictions'):
                 data['dietary_restrictions'] = []
             if not data.get('preferences'):
@@ -299,20 +588,81 @@ Please provide all this information in your response, and I'll create a customiz
         
         return data
     
-    def _check_missing_fields(self, user_data: Dict) -> List[str]:
+    def _extract_budget(self, text_lower: str, has_digit: bool, has_dollar: bool, has_budget_kw: bool) -> Optional[float]:
+        """Find an explicit budget amount, trying each heuristic in priority order"""
+        text = text_lower
+        
+        # 1. First number after "budget" on the same line ("budget is $100", "budget: 80 cad")
+        if has_digit and has_budget_kw:
+            start = text.find('budget')
+            while start != -1:
+                after = start + 6
+                run = _DIGIT_RUN.search(text, after)
+                if run is None:
+                    break
+                # Only the whitespace (and an optional '$') right before the number may span lines
+                gap_end = run.start()
+                while gap_end > after and text[gap_end - 1].isspace():
+                    gap_end -= 1
+                if gap_end > after and text[gap_end - 1] == '$':
+                    gap_end -= 1
+                if '\n' not in text[after:gap_end]:
+                    value = float(text[run.start():_amount_end(text, run.end())])
+                    if 10 <= value <= 10000:
+                        return value
+                    break
+                start = text.find('budget', start + 1)
+        
+        if has_dollar:
+            # 2. "$X" after budget/spend/afford on the same line
+            for line in text.split('\n'):
+                keyword_ends = [i + len(kw) for kw in _BUDGET_KEYWORDS for i in (line.find(kw),) if i != -1]
+                if not keyword_ends:
+                    continue
+                dollar = _find_dollar_amount(line, min(keyword_ends))
+                if dollar != -1:
+                    run = _DIGIT_RUN.match(line, dollar + 1)
+                    value = float(line[run.start():_amount_end(line, run.end())])
+                    if 10 <= value <= 10000:
+                        return value
+                    break
+            
+            # 3. First "$X" when budget context words appear within 20 characters
+            dollar = _find_dollar_amount(text)
+            if dollar != -1:
+                run = _DIGIT_RUN.match(text, dollar + 1)
+                amount_end = _amount_end(text, run.end())
+                end = _skip_space(text, amount_end)
+                for suffix in _DOLLAR_SUFFIXES:
+                    if text.startswith(suffix, end):
+                        end += len(suffix)
+                        break
+                context_text = text[max(0, dollar - 20):dollar] + text[end:end + 20]
+                if any(word in context_text for word in _BUDGET_CONTEXT_WORDS):
+                    value = float(text[run.start():amount_end])
+                    if 10 <= value <= 10000:
+                        return value
+        
+        # 4. "100 cad" / "100 dollars", only when "budget" is mentioned
+        if has_budget_kw and has_digit:
+            for run in _DIGIT_RUN.finditer(text):
+                run_end = run.end()
+                amount_end = _amount_end(text, run_end)
+                # Try with the decimal part first, like the greedy regex it replaces
+                for end in (amount_end, run_end):
+                    if text.startswith(_CURRENCY_SUFFIXES, _skip_space(text, end)):
+                        value = float(text[run.start():end])
+                        return value if 10 <= value <= 10000 else None
+        
+        return None
+    
+    def _check_missing_fields(self, user_data: Dict) -> Tuple[str, ...]:
         """Check which required fields are missing"""
-        required_fields = {
-            'people': 'Household size',
-            'budget': 'Weekly budget',
-            'location': 'Location'
-        }
-        
-        missing = []
-        for field, label in required_fields.items():
-            if not user_data.get(field):
-                missing.append(label)
-        
-        return missing
+        return tuple(label for value, label in (
+            (user_data.get('people'), 'Household size'),
+            (user_data.get('budget'), 'Weekly budget'),
+            (user_data.get('location'), 'Location')
+        ) if not value)
     
     def _generate_confirmation(self, user_data: Dict) -> Dict:
         """Generate confirmation message"""
@@ -325,26 +675,19 @@ Please provide all this information in your response, and I'll create a customiz
         dietary_str = ', '.join(dietary) if dietary else 'None'
         preferences_str = preferences if preferences and preferences.lower() not in ['none', 'no', 'n/a', ''] else 'None'
         
-        message = "Just to confirm your information:\n\n"
+        household_str = f"{people} people" if people else "Not provided"
+        budget_str = f"${budget:.2f} CAD" if budget and isinstance(budget, (int, float)) else "Not provided"
+        location_str = location if location else "Not provided"
         
-        if people:
-            message += f"👨‍👩‍👧‍👦 **Household Size**: {people} people\n"
-        else:
-            message += f"👨‍👩‍👧‍👦 **Household Size**: Not provided\n"
-        
-        if budget and isinstance(budget, (int, float)):
-            message += f"💰 **Weekly Budget**: ${budget:.2f} CAD\n"
-        else:
-            message += f"💰 **Weekly Budget**: Not provided\n"
-        
-        if location:
-            message += f"📍 **Location**: {location}\n"
-        else:
-            message += f"📍 **Location**: Not provided\n"
-        
-        message += f"🥗 **Dietary Restrictions**: {dietary_str}\n"
-        message += f"🍽️ **Preferences**: {preferences_str}\n\n"
-        message += "Is this information correct? (Yes/No)"
+        message = "".join((
+            "Just to confirm your information:\n\n",
+            f"👨‍👩‍👧‍👦 **Household Size**: {household_str}\n",
+            f"💰 **Weekly Budget**: {budget_str}\n",
+            f"📍 **Location**: {location_str}\n",
+            f"🥗 **Dietary Restrictions**: {dietary_str}\n",
+            f"🍽️ **Preferences**: {preferences_str}\n\n",
+            "Is this information correct? (Yes/No)"
+        ))
         
         return {'message': message, 'user_data': user_data}
     
@@ -358,7 +701,7 @@ Please provide all this information in your response, and I'll create a customiz
                 user_data.get('location') and
                 not session.get('meal_plan_generated', False))
     
-    def _get_dynamic_prompt(self, field_name: str, user_data: Dict, conversation_history: List[Dict]) -> str:
+    async def _get_dynamic_prompt(self, field_name: str, user_data: Dict, conversation_history: ConversationHistory) -> str:
         """Generate dynamic prompt for missing field using API, with static fallback"""
         # Static fallback prompts
         static_prompts = {
@@ -383,6 +726,11 @@ Please provide all this information in your response, and I'll create a customiz
             
             context = ". ".join(context_parts) if context_parts else "No information collected yet."
             
+            cache_key = (field_name, context)
+            cached = self._prompt_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             system_message = """You are NutriBudget AI, a helpful nutrition assistant. Generate a friendly, natural prompt asking for missing information. 
 Keep it concise (1-2 sentences), friendly, and include helpful examples. Return only the prompt text, no additional explanation."""
             
@@ -392,7 +740,7 @@ I need to ask for: {field_name}
 
 Generate a friendly, conversational prompt asking for this information. Include 1-2 examples of how they might respond. Keep it warm and helpful."""
             
-            response = self.openai_client.chat.completions.create(
+            response = await self.openai_client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": system_message},
@@ -409,13 +757,14 @@ Generate a friendly, conversational prompt asking for this information. Include
             elif dynamic_prompt.startswith("'") and dynamic_prompt.endswith("'"):
                 dynamic_prompt = dynamic_prompt[1:-1]
             
+            self._prompt_cache[cache_key] = dynamic_prompt
             return dynamic_prompt
         except Exception as e:
             # Fallback to static on any error
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Error generating dynamic prompt: {e}, using static fallback")
+            print(f"[{time.strftime('%H:%M:%S')}] Error generating dynamic prompt: {e}, using static fallback")
             return static_prompts.get(field_name, f"I need your {field_name.lower()}. Could you provide that information?")
     
-    def _get_gpt_response(self, conversation_history: List[Dict], user_data: Dict) -> Dict:
+    async def _get_gpt_response(self, conversation_history: ConversationHistory, user_data: Dict) -> Dict:
         """Get GPT response for general conversation"""
         # If no API key or test mode, return helpful response
         if self.test_mode or not self.openai_client:
@@ -427,11 +776,11 @@ Generate a friendly, conversational prompt asking for this information. Include
             system_message = """You are NutriBudget AI, a helpful nutrition assistant helping families create affordable meal plans. 
 Be friendly, empathetic, and practical. Guide users to provide: household size, weekly budget, dietary restrictions, and location."""
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": system_message},
-                    *conversation_history[-10:]  # Last 10 messages for context
+                    *conversation_history.recent(10)  # Last 10 messages for context
                 ],
                 max_tokens=200,
                 temperature=0.7
@@ -0,0 +1,39 @@
+import functools
+import re
+from typing import Dict, Iterable, Tuple
+
+
+# Cap on remembered regex results per matcher, since recipe names come from model output
+SEARCH_MEMO_SIZE = 1024
+
+
+class IngredientMatcher:
+    """Fuzzy ingredient lookup: a name matches if it contains, or is contained in, an available name"""
+    __slots__ = ('_joined', '_pattern', '_searched')
+    
+    def __init__(self, available_names: Iterable[str]):
+        names = set(available_names)
+        # All names in one NUL-separated string, so "name in avail" is a single substring search
+        self._joined = '\x00'.join(names) if names else None
+        # One alternation over all names, so "avail in name" is a single regex scan
+        self._pattern = re.compile('|'.join(map(re.escape, names))) if names else None
+        # Regex results for names not found in the joined string; the same recipe names recur across plans
+        self._searched: Dict[str, bool] = {}
+    
+    def __contains__(self, name: str) -> bool:
+        # A NUL in the query could straddle two names
+        if self._joined is not None and '\x00' not in name and name in self._joined:
+            return True
+        found = self._searched.get(name)
+        if found is None:
+            found = self._pattern is not None and self._pattern.search(name) is not None
+            if len(self._searched) >= SEARCH_MEMO_SIZE:
+                self._searched.clear()
+            self._searched[name] = found
+        return found
+
+
+@functools.lru_cache(maxsize=64)
+def ingredient_matcher(available_names: Tuple[str, ...]) -> IngredientMatcher:
+    """Shared matcher per ingredient list, since research results repeat across plans"""
+    return IngredientMatcher(available_names)
@@ -1,177 +1,479 @@
+import asyncio
+import functools
+import hashlib
+import httpx
+import itertools
 import openai
+import orjson
 import os
-import json
-from typing import List, Dict
-from datetime import datetime
+import time
+from cachetools import TTLCache
+from collections import deque
+from typing import AsyncIterator, Deque, List, Dict, Optional, Tuple
+from utils.ingredient_match import IngredientMatcher, ingredient_matcher
+from utils.price_table import fallback_price
+
+
+def _strict_object(**properties) -> Dict:
+    """JSON schema for an object whose listed properties are all required, as strict mode demands"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+_STRING = {"type": "string"}
+_NUMBER = {"type": "number"}
+
+_MEAL_SCHEMA = _strict_object(
+    name=_STRING,
+    ingredients={"type": "array", "items": _strict_object(name=_STRING, quantity=_STRING)},
+    recipe=_STRING,
+    cooking_time=_STRING,
+    difficulty={"type": "string", "enum": ["easy", "medium", "hard"]},
+    cost=_NUMBER
+)
+
+_GROCERY_PROPERTIES = dict(
+    grocery_list={"type": "array", "items": _strict_object(
+        ingredient=_STRING,
+        quantity=_STRING,
+        unit=_STRING,
+        estimated_cost=_NUMBER,
+        category=_STRING
+    )},
+    total_grocery_cost=_NUMBER
+)
+
+_MEALS_PROPERTIES = dict(
+    days={"type": "array", "items": _strict_object(
+        day=_STRING,
+        meals=_strict_object(breakfast=_MEAL_SCHEMA, lunch=_MEAL_SCHEMA, dinner=_MEAL_SCHEMA)
+    )},
+    weekly_summary=_strict_object(
+        total_cost=_NUMBER,
+        serves={"type": "integer"},
+        location=_STRING,
+        budget_utilization=_STRING
+    ),
+    cooking_tips={"type": "array", "items": _STRING},
+    storage_advice={"type": "array", "items": _STRING}
+)
+
+# Structured output schema, so the prompt doesn't have to spell out the JSON layout
+_MEAL_PLAN_SCHEMA = _strict_object(**_GROCERY_PROPERTIES, **_MEALS_PROPERTIES)
+
+# Live requests make two smaller calls: the grocery list, then meals planned from that list
+_GROCERY_SCHEMA = _strict_object(**_GROCERY_PROPERTIES)
+_MEALS_SCHEMA = _strict_object(**_MEALS_PROPERTIES)
+_GROCERY_MAX_TOKENS = 1000
+_MEALS_MAX_TOKENS = 3000
+
+# Everything that doesn't vary per user, so OpenAI's prompt cache can reuse the prefix
+_SYSTEM_PROMPT = """You are a nutrition expert that creates affordable, healthy meal plans with detailed grocery lists.
+Create a comprehensive weekly meal plan and grocery shopping list for the user's household.
+
+Requirements:
+- Use ONLY ingredients from the user's list of available ingredients
+- Respect the user's dietary restrictions and preferences
+- Ensure nutritional balance
+- Stay under the weekly budget for the stated number of people
+- Create a complete grocery shopping list with quantities
+- Provide 7 days of meals (breakfast, lunch, dinner), Monday through Sunday
+- Include cooking tips and storage advice
+- Give every cost in CAD and report budget utilization as a percentage string"""
+
+# Per-user message; ingredients lead so users researched in the same city share a longer cached prefix
+_PROMPT_TEMPLATE = """Available ingredients:
+{ingredients}
+
+{details}"""
+
+_DETAILS_TEMPLATE = """Budget: ${budget} CAD per week for {people} people
+Dietary restrictions: {dietary_restrictions}
+Preferences: {preferences}
+Location: {location}"""
+
+_GROCERY_INSTRUCTION = "Respond with the grocery shopping list for the week."
+
+# The meals call sees the chosen groceries instead of every available ingredient
+_MEALS_PROMPT_TEMPLATE = """Grocery list (total ${total_grocery_cost} CAD):
+{grocery_list}
+
+{details}
+
+Respond with the 7 days of meals, weekly summary, cooking tips and storage advice.
+Use only items on the grocery list, and report the grocery total as the weekly total cost."""
+
 
 class MealPlanner:
-    def __init__(self, perplexity_client):
+    def __init__(self, perplexity_client, pool_size: int = 100, max_concurrency: int = 8,
+                 cache_size: int = 256, cache_ttl: float = 6 * 3600, hedge_delay: float = 45.0):
         api_key = os.getenv('OPENAI_API_KEY')
-        self.openai_client = openai.OpenAI(api_key=api_key) if api_key else None
+        # Long-lived pooled client shared by every OpenAI call
+        self._http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max(1, pool_size // 2),
+                keepalive_expiry=60.0
+            ),
+            timeout=30.0
+        )
+        self.openai_client = openai.AsyncOpenAI(api_key=api_key, http_client=self._http) if api_key else None
         self.perplexity_client = perplexity_client
+        # Caps meal plans generated at once across sessions to stay under rate limits
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Seconds an attempt may run before a backup attempt is started alongside it
+        self._hedge_delay = hedge_delay
+        # Meal plans currently being generated, so identical requests share one result
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Validated meal plans keyed by the SHA-256 of the prompt that produced them
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+    
+    async def warm_up(self):
+        """Open a connection to the OpenAI API ahead of the first request"""
+        if not self.openai_client:
+            return
+        try:
+            await self._http.head(str(self.openai_client.base_url))
+        except httpx.HTTPError as e:
+            print(f"[{time.strftime('%H:%M:%S')}] OpenAI warm-up failed: {e}")
+    
+    async def aclose(self):
+        """Close pooled connections"""
+        await self._http.aclose()
     
-    def generate_meal_plan(self, user_data: Dict, ingredients: List[Dict], activity_log: List[str]) -> Dict:
+    async def generate_meal_plan(self, user_data: Dict, ingredients: List[Dict], activity_log: Deque[Tuple[float, str]]) -> Dict:
         """Generate comprehensive meal plan with grocery list"""
         # If no API key, use fallback
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
-            activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] 📋 Using fallback meal plan (no API key)")
+            self._log(activity_log, "📋 Using fallback meal plan (no API key)")
             return self._create_fallback_meal_plan(user_data, ingredients, activity_log)
         
-        budget = user_data.get('budget', 0)
-        people = user_data.get('people', 1)
+        # Only requests with an identical prompt (exact budget, same ingredients) share a generation
+        prompt = self._build_prompt(user_data, ingredients)
+        key = self._prompt_key(prompt)
+        generation = self._inflight.get(key)
+        if generation is not None:
+            self._log(activity_log, "⏳ Joining an identical meal plan already in progress...")
+        else:
+            # Its own task, so the generation outlives whichever request started it
+            generation = asyncio.create_task(
+                self._generate_with_openai(user_data, ingredients, prompt, key, activity_log)
+            )
+            self._inflight[key] = generation
+            generation.add_done_callback(functools.partial(self._generation_done, key))
+        # Shield so a cancelled request doesn't cancel the generation others are waiting on
+        return await asyncio.shield(generation)
+    
+    def _generation_done(self, key: str, generation: asyncio.Task):
+        """Forget a finished generation"""
+        if self._inflight.get(key) is generation:
+            del self._inflight[key]
+        # Mark retrieved so a failure nobody awaited isn't logged as unhandled
+        if not generation.cancelled():
+            generation.exception()
+    
+    @staticmethod
+    def _log(activity_log: Deque[Tuple[float, str]], message: str):
+        """Append a timestamped entry to the activity log"""
+        activity_log.append((time.time(), message))
+    
+    @staticmethod
+    def _prompt_key(prompt: str) -> str:
+        """Hash a rendered prompt into the key shared by the plan cache and in-flight generations"""
+        return hashlib.sha256(prompt.encode()).hexdigest()
+    
+    async def _generate_with_openai(self, user_data: Dict, ingredients: List[Dict], prompt: str, cache_key: str,
+                                    activity_log: Deque[Tuple[float, str]]) -> Dict:
+        """Generate a meal plan with OpenAI, retrying and falling back as needed"""
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._log(activity_log, "⚡ Reusing a meal plan generated for the same ingredients")
+            return cached
+        
+        max_retries = 3
+        try:
+            available = self._available(ingredients)
+        except (KeyError, TypeError, AttributeError) as e:
+            # Plans can't be validated against malformed research results
+            self._log(activity_log, f"⚠️ Error generating meal plan: {str(e)}")
+        else:
+            self._log(activity_log, "🍳 Generating meal options...")
+            details = self._build_details(user_data)
+            meal_plan = await self._hedged_attempts(prompt, details, available, max_retries, activity_log)
+            if meal_plan is not None:
+                self._log(activity_log, "🎉 Meal plan verified and ready!")
+                self._cache[cache_key] = meal_plan
+                return meal_plan
+        
+        # Fallback meal plan
+        self._log(activity_log, "📋 Using fallback meal plan")
+        return self._create_fallback_meal_plan(user_data, ingredients, activity_log)
+    
+    async def _hedged_attempts(self, prompt: str, details: str, available: IngredientMatcher, max_attempts: int,
+                               activity_log: Deque[Tuple[float, str]]) -> Optional[Dict]:
+        """Return the first plan that validates, starting another attempt only when one fails or runs slow"""
+        attempts: List[asyncio.Task] = []
+        pending = set()
+        # One slot per plan, however many attempts it ends up running
+        async with self._semaphore:
+            try:
+                while True:
+                    if len(attempts) < max_attempts:
+                        attempt = asyncio.create_task(self._attempt(prompt, details, available, activity_log))
+                        attempts.append(attempt)
+                        pending.add(attempt)
+                    elif not pending:
+                        return None
+                    
+                    # Wake on the hedge delay only while there is another attempt left to start
+                    done, pending = await asyncio.wait(
+                        pending,
+                        timeout=self._hedge_delay if len(attempts) < max_attempts else None,
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for attempt in done:
+                        meal_plan = attempt.result()
+                        if meal_plan is not None:
+                            return meal_plan
+                    if done and (pending or len(attempts) < max_attempts):
+                        self._log(activity_log, "🔄 Re-generating grocery list - improving accuracy...")
+            finally:
+                for attempt in attempts:
+                    attempt.cancel()
+    
+    def _build_prompt(self, user_data: Dict, ingredients: List[Dict]) -> str:
+        """Render the meal plan prompt for one user"""
+        # Create ingredient list string (sorted keys so equivalent inputs give the same prompt)
+        ingredients_str = orjson.dumps(ingredients, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
+        return _PROMPT_TEMPLATE.format(ingredients=ingredients_str, details=self._build_details(user_data))
+    
+    @staticmethod
+    def _build_details(user_data: Dict) -> str:
+        """Render the user's budget, household and preferences"""
         dietary_restrictions = user_data.get('dietary_restrictions', [])
         preferences = user_data.get('preferences', '')
-        location = user_data.get('location', '')
+        return _DETAILS_TEMPLATE.format(
+            budget=user_data.get('budget', 0),
+            people=user_data.get('people', 1),
+            dietary_restrictions=', '.join(dietary_restrictions) if dietary_restrictions else 'None',
+            preferences=preferences if preferences else 'None',
+            location=user_data.get('location', '')
+        )
+    
+    @staticmethod
+    def _meals_prompt(grocery: Dict, details: str) -> str:
+        """Render the follow-up prompt that plans meals from a generated grocery list"""
+        return _MEALS_PROMPT_TEMPLATE.format(
+            total_grocery_cost=grocery['total_grocery_cost'],
+            grocery_list=orjson.dumps(grocery['grocery_list'], option=orjson.OPT_INDENT_2).decode(),
+            details=details
+        )
+    
+    @staticmethod
+    def _chat_request(prompt: str, name: str = "meal_plan", schema: Dict = _MEAL_PLAN_SCHEMA,
+                      max_tokens: int = 4000) -> Dict:
+        """Chat completion parameters for one meal plan request"""
+        return {
+            "model": "gpt-4o-2024-08-06",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": _SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7,
+            "max_tokens": max_tokens,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": name, "strict": True, "schema": schema}
+            }
+        }
+    
+    @staticmethod
+    def _parse_meal_plan(content: Optional[str]) -> Optional[Dict]:
+        """Decode a structured-output completion, or None if the model refused"""
+        if not content:
+            return None
+        return orjson.loads(content)
+    
+    @staticmethod
+    async def _read_json_object(stream: openai.AsyncStream) -> str:
+        """Collect a streamed completion, stopping as soon as its top-level JSON object closes"""
+        parts: List[str] = []
+        depth = 0
+        started = in_string = escaped = False
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            text = chunk.choices[0].delta.content
+            # Track brace depth outside of string literals so a "}" inside a recipe doesn't end early
+            for index, char in enumerate(text):
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == '\\':
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char == '{':
+                    depth += 1
+                    started = True
+                elif char == '}' and started:
+                    depth -= 1
+                    if depth == 0:
+                        # Skip the trailing tokens and free the connection for the next attempt
+                        parts.append(text[:index + 1])
+                        await stream.close()
+                        return "".join(parts)
+            parts.append(text)
+        return "".join(parts)
+    
+    @staticmethod
+    def _available(ingredients: List[Dict]) -> IngredientMatcher:
+        """Lowercase the ingredient names once and get their shared matcher"""
+        return ingredient_matcher(tuple(ing['name'].lower() for ing in ingredients))
+    
+    async def _request_part(self, prompt: str, name: str, schema: Dict, max_tokens: int) -> Optional[Dict]:
+        """Stream one structured completion and decode it"""
+        stream = await self.openai_client.chat.completions.create(
+            **self._chat_request(prompt, name, schema, max_tokens),
+            stream=True
+        )
+        return self._parse_meal_plan(await self._read_json_object(stream))
+    
+    async def _attempt(self, prompt: str, details: str, available: IngredientMatcher,
+                       activity_log: Deque[Tuple[float, str]]) -> Optional[Dict]:
+        """Request one meal plan, returning it only if it parses and validates"""
+        try:
+            grocery = await self._request_part(
+                f"{prompt}\n\n{_GROCERY_INSTRUCTION}", "grocery_list", _GROCERY_SCHEMA, _GROCERY_MAX_TOKENS
+            )
+            meals = None
+            if grocery is not None:
+                # Planned from the grocery list so the two halves agree on items and cost
+                meals = await self._request_part(
+                    self._meals_prompt(grocery, details), "meals", _MEALS_SCHEMA, _MEALS_MAX_TOKENS
+                )
+            
+            meal_plan = {**grocery, **meals} if meals is not None else None
+            if meal_plan is not None:
+                # Validate recipes
+                self._log(activity_log, "✅ Verifying recipe accuracy and ingredient availability...")
+                if self._validate_meal_plan(meal_plan, available, activity_log):
+                    return meal_plan
         
-        # Create ingredient list string
-        ingredients_str = json.dumps(ingredients, indent=2)
+        except orjson.JSONDecodeError as e:
+            self._log(activity_log, f"⚠️ Error parsing meal plan: {str(e)}")
+        except Exception as e:
+            self._log(activity_log, f"⚠️ Error generating meal plan: {str(e)}")
+        return None
+    
+    async def generate_meal_plans_batch(self, jobs: List[Tuple[Dict, List[Dict]]], max_concurrency: int = 4) -> List[Dict]:
+        """Generate plans for many (user_data, ingredients) pairs concurrently, in input order"""
+        # Kept under the planner's own cap so a batch leaves slots for live chat requests
+        limit = asyncio.Semaphore(max_concurrency)
         
-        prompt = f"""Create a comprehensive weekly meal plan and grocery shopping list using ONLY these available ingredients:
-{ingredients_str}
-
-Requirements:
-- Budget: ${budget} CAD per week for {people} people
-- Dietary restrictions: {', '.join(dietary_restrictions) if dietary_restrictions else 'None'}
-- Preferences: {preferences if preferences else 'None'}
-- Location: {location}
-- Use ONLY ingredients from the list above
-- Ensure nutritional balance
-- Stay under budget
-- Create a complete grocery shopping list with quantities
-- Provide 7 days of meals (breakfast, lunch, dinner)
-- Include cooking tips and storage advice
-
-Return as JSON with this exact structure:
-{{
-    "grocery_list": [
-        {{
-            "ingredient": "ingredient name",
-            "quantity": "amount needed",
-            "unit": "unit of measurement",
-            "estimated_cost": price in CAD,
-            "category": "category name"
-        }}
-    ],
-    "total_grocery_cost": total_cost,
-    "days": [
-        {{
-            "day": "Monday",
-            "meals": {{
-                "breakfast": {{
-                    "name": "meal name",
-                    "ingredients": [{{"name": "ingredient", "quantity": "amount"}}],
-                    "recipe": "simple recipe instructions",
-                    "cooking_time": "time estimate",
-                    "difficulty": "easy/medium/hard",
-                    "cost": price
-                }},
-                "lunch": {{...}},
-                "dinner": {{...}}
-            }}
-        }}
-    ],
-    "weekly_summary": {{
-        "total_cost": total_cost,
-        "serves": {people},
-        "location": "{location}",
-        "budget_utilization": "percentage of budget used"
-    }},
-    "cooking_tips": [
-        "tip 1",
-        "tip 2",
-        "tip 3"
-    ],
-    "storage_advice": [
-        "advice 1",
-        "advice 2"
-    ]
-}}
-Return ONLY valid JSON, no additional text."""
+        async def run(user_data: Dict, ingredients: List[Dict]) -> Dict:
+            async with limit:
+                return await self.generate_meal_plan(user_data, ingredients, deque(maxlen=256))
         
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] 🍳 Generating meal options...")
-                
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a nutrition expert that creates affordable, healthy meal plans with detailed grocery lists. Always return valid JSON only."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    temperature=0.7,
-                    max_tokens=4000
-                )
-                
-                content = response.choices[0].message.content
-                
-                # Extract JSON
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start != -1 and json_end > json_start:
-                    json_str = content[json_start:json_end]
-                    meal_plan = json.loads(json_str)
-                    
-                    # Validate recipes
-                    activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Verifying recipe accuracy and ingredient availability...")
-                    validated = self._validate_meal_plan(meal_plan, ingredients, activity_log)
-                    
-                    if validated:
-                        activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] 🎉 Meal plan verified and ready!")
-                        return meal_plan
-                    else:
-                        if attempt < max_retries - 1:
-                            activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] 🔄 Re-generating grocery list - improving accuracy...")
-                            continue
-                
-            except json.JSONDecodeError as e:
-                activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Error parsing meal plan: {str(e)}")
-                if attempt < max_retries - 1:
+        return await asyncio.gather(*(run(user_data, ingredients) for user_data, ingredients in jobs))
+    
+    async def submit_batch(self, jobs: Dict[str, Tuple[Dict, List[Dict]]]) -> str:
+        """Queue meal plans for {user_id: (user_data, ingredients)} on the OpenAI Batch API, returning the batch id"""
+        lines = [
+            orjson.dumps({
+                "custom_id": user_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._chat_request(self._build_prompt(user_data, ingredients))
+            })
+            for user_id, (user_data, ingredients) in jobs.items()
+        ]
+        batch_file = await self.openai_client.files.create(
+            file=("meal_plans.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await self.openai_client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        print(f"[{time.strftime('%H:%M:%S')}] Submitted meal plan batch {batch.id} for {len(lines)} users")
+        return batch.id
+    
+    async def collect_batch(self, batch_id: str, jobs: Dict[str, Tuple[Dict, List[Dict]]],
+                            poll_interval: float = 60.0) -> AsyncIterator[Tuple[str, Dict]]:
+        """Wait for a submitted batch and yield (user_id, meal_plan), using the fallback plan for failed lines"""
+        batch = await self.openai_client.batches.retrieve(batch_id)
+        while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            await asyncio.sleep(poll_interval)
+            batch = await self.openai_client.batches.retrieve(batch_id)
+        
+        results: Dict[str, Optional[Dict]] = {}
+        if batch.output_file_id:
+            output = await self.openai_client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                if not line:
                     continue
-            except Exception as e:
-                activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Error generating meal plan: {str(e)}")
-                if attempt < max_retries - 1:
+                result = orjson.loads(line)
+                user_id = result.get('custom_id')
+                if user_id not in jobs:
                     continue
+                try:
+                    content = result['response']['body']['choices'][0]['message']['content']
+                    meal_plan = self._parse_meal_plan(content)
+                    available = self._available(jobs[user_id][1])
+                    if meal_plan is not None and not self._validate_meal_plan(meal_plan, available, deque(maxlen=256)):
+                        meal_plan = None
+                except (KeyError, IndexError, TypeError, AttributeError, orjson.JSONDecodeError):
+                    meal_plan = None
+                results[user_id] = meal_plan
         
-        # Fallback meal plan
-        activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] 📋 Using fallback meal plan")
-        return self._create_fallback_meal_plan(user_data, ingredients, activity_log)
+        for user_id, (user_data, ingredients) in jobs.items():
+            meal_plan = results.get(user_id)
+            if meal_plan is None:
+                meal_plan = self._create_fallback_meal_plan(user_data, ingredients, deque(maxlen=256))
+            else:
+                self._cache[self._prompt_key(self._build_prompt(user_data, ingredients))] = meal_plan
+            yield user_id, meal_plan
     
-    def _validate_meal_plan(self, meal_plan: Dict, ingredients: List[Dict], activity_log: List[str]) -> bool:
+    def _validate_meal_plan(self, meal_plan: Dict, available: IngredientMatcher, activity_log: Deque[Tuple[float, str]]) -> bool:
         """Validate that meal plan uses only available ingredients"""
-        days = meal_plan.get('days', [])
-        available_names = [ing['name'].lower() for ing in ingredients]
-        grocery_list = meal_plan.get('grocery_list', [])
-        
-        # Validate grocery list items are available
-        for item in grocery_list:
-            item_name = item.get('ingredient', '').lower()
-            if not any(avail in item_name or item_name in avail for avail in available_names):
-                activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Grocery item '{item.get('ingredient')}' not found in available ingredients")
-                return False
-        
-        # Validate meal ingredients
-        for day in days:
-            meals = day.get('meals', {})
-            for meal_type, meal in meals.items():
-                meal_ingredients = meal.get('ingredients', [])
-                for ing in meal_ingredients:
-                    ing_name = ing.get('name', '').lower()
-                    # Check if ingredient is available
-                    if not any(avail in ing_name or ing_name in avail for avail in available_names):
-                        activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Recipe ingredient '{ing.get('name')}' not available")
-                        return False
+        # Structured output guarantees the layout, so index directly and treat any gap as invalid
+        try:
+            # Validate grocery list items are available
+            for item in meal_plan['grocery_list']:
+                if item['ingredient'].lower() not in available:
+                    self._log(activity_log, f"⚠️ Grocery item '{item['ingredient']}' not found in available ingredients")
+                    return False
+            
+            # Validate meal ingredients
+            for day in meal_plan['days']:
+                for meal in day['meals'].values():
+                    for ing in meal['ingredients']:
+                        if ing['name'].lower() not in available:
+                            self._log(activity_log, f"⚠️ Recipe ingredient '{ing['name']}' not available")
+                            return False
+        except (KeyError, TypeError, AttributeError):
+            self._log(activity_log, "⚠️ Meal plan is missing required fields")
+            return False
         
         return True
     
-    def _create_fallback_meal_plan(self, user_data: Dict, ingredients: List[Dict], activity_log: List[str]) -> Dict:
+    def _create_fallback_meal_plan(self, user_data: Dict, ingredients: List[Dict], activity_log: Deque[Tuple[float, str]]) -> Dict:
         """Create a comprehensive fallback meal plan"""
         people = user_data.get('people', 1)
         budget = user_data.get('budget')  # Don't use default - budget should be provided
@@ -183,20 +485,23 @@ Return ONLY valid JSON, no additional text."""
             # Estimate budget based on meal costs and people
             estimated_daily_cost = 12.0  # Average cost per person per day
             budget = estimated_daily_cost * people * 7  # Weekly estimate
-            activity_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ No budget provided, using estimated budget of ${budget:.2f}")
+            self._log(activity_log, f"⚠️ No budget provided, using estimated budget of ${budget:.2f}")
         
         # Get available ingredient names
-        available_ingredients = [ing.get('name', '') for ing in ingredients]
-        available_with_prices = {ing.get('name', '').lower(): ing.get('price', 0) for ing in ingredients}
+        available = ingredient_matcher(tuple(ing.get('name', '').lower() for ing in ingredients))
         
         # Create grocery list from available ingredients
         grocery_list = []
         for ing in ingredients[:20]:  # Top 20 ingredients
+            price = ing.get('price')
+            if price is None:
+                # Typical price rather than 0, so unpriced items still count toward the total
+                price = fallback_price(ing.get('name', ''))
             grocery_list.append({
                 "ingredient": ing.get('name', ''),
                 "quantity": "varies",
                 "unit": "as needed",
-                "estimated_cost": ing.get('price', 0),
+                "estimated_cost": price,
                 "category": ing.get('category', 'other')
             })
         
@@ -291,8 +596,7 @@ Return ONLY valid JSON, no additional text."""
         # Filter based on available ingredients
         def ingredient_available(meal_ingredients):
             for ing in meal_ingredients:
-                ing_name = ing.get('name', '').lower()
-                if not any(avail.lower() in ing_name or ing_name in avail.lower() for avail in available_ingredients):
+                if ing.get('name', '').lower() not in available:
                     return False
             return True
         
@@ -302,11 +606,13 @@ Return ONLY valid JSON, no additional text."""
         
         # Generate weekly plan
         total_cost = 0
-        for i, day in enumerate(days):
-            breakfast = filtered_breakfast[i % len(filtered_breakfast)].copy()
-            lunch = filtered_lunch[i % len(filtered_lunch)].copy()
-            dinner = filtered_dinner[i % len(filtered_dinner)].copy()
-            
+        # Days share the template dicts; they are only copied if costs need scaling
+        for day, breakfast, lunch, dinner in zip(
+            days,
+            itertools.cycle(filtered_breakfast),
+            itertools.cycle(filtered_lunch),
+            itertools.cycle(filtered_dinner)
+        ):
             day_cost = breakfast['cost'] + lunch['cost'] + dinner['cost']
             total_cost += day_cost
             
@@ -324,14 +630,22 @@ Return ONLY valid JSON, no additional text."""
         
         if total_cost > budget:
             scale_factor = (budget * 0.9) / total_cost
+            # Scale each distinct template once; days rotating onto it share the scaled copy
+            scaled: Dict[int, Dict] = {}
             for day in weekly_plan:
-                for meal_type in day['meals']:
-                    day['meals'][meal_type]['cost'] = day['meals'][meal_type]['cost'] * scale_factor
+                meals = day['meals']
+                for meal_type, meal in meals.items():
+                    scaled_meal = scaled.get(id(meal))
+                    if scaled_meal is None:
+                        scaled_meal = scaled[id(meal)] = {**meal, 'cost': meal['cost'] * scale_factor}
+                    meals[meal_type] = scaled_meal
             total_cost = budget * 0.9
         
         budget_utilization = (total_cost / budget * 100) if budget > 0 else 0
         
         return {
+            # Template plans are never cached, here or by callers
+            "is_fallback": True,
             "grocery_list": grocery_list,
             "total_grocery_cost": round(total_grocery_cost, 2),
             "days": weekly_plan,
@@ -1,21 +1,144 @@
-import requests
+import asyncio
+import httpx
+import orjson
 import os
-import json
-from typing import List, Dict
-from datetime import datetime
+import re
+import time
+import weakref
+from cachetools import TTLCache
+from typing import List, Dict, Optional, Tuple
+from utils.ingredient_match import ingredient_matcher
+
+# String literals (skipped whole, so brackets inside names don't count) or a bracket
+_JSON_ARRAY_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]]')
+
+
+def _extract_json_array(content: str) -> Optional[str]:
+    """Slice out the first top-level JSON array in one left-to-right pass"""
+    start = content.find('[')
+    if start == -1:
+        return None
+    depth = 0
+    for token in _JSON_ARRAY_TOKEN.finditer(content, start):
+        bracket = token.group()
+        if bracket == '[':
+            depth += 1
+        elif bracket == ']':
+            depth -= 1
+            if depth == 0:
+                return content[start:token.end()]
+    # Unbalanced; let the decoder report where it breaks
+    return content[start:]
+
+
+# Built once at import; returned when there is no API key or the API fails
+_MOCK_INGREDIENTS = (
+    {"name": "Brown Rice", "price": 2.50, "store": "Walmart", "category": "grains", "unit": "per lb"},
+    {"name": "Chicken Breast", "price": 4.99, "store": "Walmart", "category": "proteins", "unit": "per lb"},
+    {"name": "Black Beans", "price": 1.25, "store": "Walmart", "category": "proteins", "unit": "per can"},
+    {"name": "Eggs", "price": 2.99, "store": "Walmart", "category": "proteins", "unit": "per dozen"},
+    {"name": "Potatoes", "price": 3.99, "store": "Walmart", "category": "vegetables", "unit": "per 5 lbs"},
+    {"name": "Carrots", "price": 1.50, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
+    {"name": "Broccoli", "price": 2.99, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
+    {"name": "Onions", "price": 1.99, "store": "Walmart", "category": "vegetables", "unit": "per 3 lbs"},
+    {"name": "Bananas", "price": 1.99, "store": "Walmart", "category": "fruits", "unit": "per lb"},
+    {"name": "Apples", "price": 2.99, "store": "Walmart", "category": "fruits", "unit": "per lb"},
+    {"name": "Whole Wheat Bread", "price": 2.50, "store": "Walmart", "category": "grains", "unit": "per loaf"},
+    {"name": "Oats", "price": 2.99, "store": "Walmart", "category": "grains", "unit": "per container"},
+    {"name": "Ground Turkey", "price": 4.50, "store": "Walmart", "category": "proteins", "unit": "per lb"},
+    {"name": "Spinach", "price": 2.50, "store": "Walmart", "category": "vegetables", "unit": "per bag"},
+    {"name": "Tomatoes", "price": 2.99, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
+    {"name": "Pasta", "price": 1.99, "store": "Walmart", "category": "grains", "unit": "per box"},
+    {"name": "Canned Tuna", "price": 1.75, "store": "Walmart", "category": "proteins", "unit": "per can"},
+    {"name": "Peanut Butter", "price": 3.50, "store": "Walmart", "category": "proteins", "unit": "per jar"},
+    {"name": "Milk", "price": 4.99, "store": "Walmart", "category": "dairy", "unit": "per gallon"},
+    {"name": "Cheese", "price": 3.99, "store": "Walmart", "category": "dairy", "unit": "per block"},
+    {"name": "Yogurt", "price": 2.99, "store": "Walmart", "category": "dairy", "unit": "per container"},
+    {"name": "Cabbage", "price": 1.99, "store": "Walmart", "category": "vegetables", "unit": "per head"},
+    {"name": "Bell Peppers", "price": 2.50, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
+    {"name": "Garlic", "price": 1.50, "store": "Walmart", "category": "vegetables", "unit": "per bulb"},
+    {"name": "Lentils", "price": 2.25, "store": "Walmart", "category": "proteins", "unit": "per lb"}
+)
+
 
 class PerplexityClient:
-    def __init__(self):
+    def __init__(self, pool_size: int = 100, cache_size: int = 2048, cache_ttl: float = 6 * 3600,
+                 max_concurrency: int = 8):
         self.api_key = os.getenv('PERPLEXITY_API_KEY')
         self.base_url = "https://api.perplexity.ai/chat/completions"
+        # Research results per (city, budget bucket), shared across sessions
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # One lock per key so concurrent identical lookups trigger a single API call;
+        # an entry lives as long as some request holds or waits on its lock
+        self._locks = weakref.WeakValueDictionary()
+        # Caps in-flight API calls across sessions to stay under rate limits
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Long-lived pooled client so each research call reuses a warm TLS connection
+        self._http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=max(1, pool_size // 2),
+                keepalive_expiry=60.0
+            ),
+            # Auth is fixed for the client's lifetime; httpx sets Content-Type for json= bodies
+            headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None,
+            timeout=30.0
+        )
+    
+    @staticmethod
+    def _log(message: str):
+        """Print a timestamped status line"""
+        print(f"[{time.strftime('%H:%M:%S')}] {message}")
+    
+    async def warm_up(self):
+        """Open a connection to the API ahead of the first request"""
+        if not self.api_key:
+            return
+        try:
+            await self._http.head(self.base_url)
+        except httpx.HTTPError as e:
+            self._log(f"Perplexity warm-up failed: {e}")
     
-    def research_ingredients(self, location: str, budget: float) -> List[Dict]:
+    async def aclose(self):
+        """Close pooled connections"""
+        await self._http.aclose()
+    
+    @staticmethod
+    def _cache_key(location: str, budget: float) -> Tuple[str, int]:
+        """Normalize location and round budget to the nearest $10"""
+        return (location.strip().lower(), round(float(budget or 0) / 10) * 10)
+    
+    async def research_ingredients(self, location: str, budget: float) -> List[Dict]:
         """Research cheapest ingredients in location"""
         # If no API key, use mock data
         if not self.api_key:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Using mock ingredients (no API key)")
+            self._log("Using mock ingredients (no API key)")
             return self._get_mock_ingredients(location, budget)
         
+        key = self._cache_key(location, budget)
+        ingredients = self._cache.get(key)
+        if ingredients is None:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock()
+            async with lock:
+                # Another request may have filled the cache while we waited
+                ingredients = self._cache.get(key)
+                if ingredients is None:
+                    ingredients = await self._fetch_ingredients(location, budget)
+                    if ingredients:
+                        self._cache[key] = ingredients
+        
+        if ingredients:
+            return ingredients
+        
+        # Fallback to mock data if API fails
+        self._log("Using mock ingredients as fallback")
+        return self._get_mock_ingredients(location, budget)
+    
+    async def _fetch_ingredients(self, location: str, budget: float) -> Optional[List[Dict]]:
+        """Query the Perplexity API, returning None if no usable result"""
         prompt = f"""Find the cheapest nutritious foods currently available in {location} for a budget of ${budget} CAD. 
         Research local grocery stores, discount markets, and seasonal deals.
         Return as JSON array with this exact structure:
@@ -33,94 +156,61 @@ class PerplexityClient:
         Return ONLY valid JSON, no additional text."""
         
         try:
-            response = requests.post(
-                self.base_url,
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "llama-3.1-sonar-small-128k-online",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "You are a helpful assistant that returns only valid JSON data about food prices and availability."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0.2,
-                    "max_tokens": 3000
-                }
-            )
+            async with self._semaphore:
+                response = await self._http.post(
+                    self.base_url,
+                    json={
+                        "model": "llama-3.1-sonar-small-128k-online",
+                        "messages": [
+                            {
+                                "role": "system",
+                                "content": "You are a helpful assistant that returns only valid JSON data about food prices and availability."
+                            },
+                            {
+                                "role": "user",
+                                "content": prompt
+                            }
+                        ],
+                        "temperature": 0.2,
+                        "max_tokens": 3000
+                    }
+                )
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 if 'choices' in result and len(result['choices']) > 0:
                     content = result['choices'][0]['message']['content']
                     
                     # Extract JSON from response
-                    json_start = content.find('[')
-                    json_end = content.rfind(']') + 1
-                    if json_start != -1 and json_end > json_start:
+                    json_str = _extract_json_array(content)
+                    if json_str is not None:
                         try:
-                            json_str = content[json_start:json_end]
-                            ingredients = json.loads(json_str)
+                            ingredients = orjson.loads(json_str)
                             if isinstance(ingredients, list) and len(ingredients) > 0:
-                                print(f"[{datetime.now().strftime('%H:%M:%S')}] Found {len(ingredients)} ingredients from Perplexity API")
+                                self._log(f"Found {len(ingredients)} ingredients from Perplexity API")
                                 return ingredients
-                        except json.JSONDecodeError as e:
-                            print(f"[{datetime.now().strftime('%H:%M:%S')}] JSON decode error: {e}")
-            
-            # Fallback to mock data if API fails
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Using mock ingredients as fallback")
-            return self._get_mock_ingredients(location, budget)
+                        except orjson.JSONDecodeError as e:
+                            self._log(f"JSON decode error: {e}")
+            return None
         
         except Exception as e:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Perplexity API error: {e}")
-            return self._get_mock_ingredients(location, budget)
+            self._log(f"Perplexity API error: {e}")
+            return None
     
     def validate_recipe(self, recipe: Dict, available_ingredients: List[Dict]) -> bool:
         """Validate that recipe uses only available ingredients"""
         recipe_ingredients = recipe.get('ingredients', [])
-        available_names = [ing['name'].lower() for ing in available_ingredients]
+        available = ingredient_matcher(tuple(ing['name'].lower() for ing in available_ingredients))
         
         for ingredient in recipe_ingredients:
             ingredient_name = ingredient.get('name', '').lower()
             # Check if ingredient is available (fuzzy match)
-            if not any(avail in ingredient_name or ingredient_name in avail for avail in available_names):
+            if ingredient_name not in available:
                 return False
         
         return True
     
     def _get_mock_ingredients(self, location: str, budget: float) -> List[Dict]:
         """Fallback mock ingredients for testing"""
-        return [
-            {"name": "Brown Rice", "price": 2.50, "store": "Walmart", "category": "grains", "unit": "per lb"},
-            {"name": "Chicken Breast", "price": 4.99, "store": "Walmart", "category": "proteins", "unit": "per lb"},
-            {"name": "Black Beans", "price": 1.25, "store": "Walmart", "category": "proteins", "unit": "per can"},
-            {"name": "Eggs", "price": 2.99, "store": "Walmart", "category": "proteins", "unit": "per dozen"},
-            {"name": "Potatoes", "price": 3.99, "store": "Walmart", "category": "vegetables", "unit": "per 5 lbs"},
-            {"name": "Carrots", "price": 1.50, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
-            {"name": "Broccoli", "price": 2.99, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
-            {"name": "Onions", "price": 1.99, "store": "Walmart", "category": "vegetables", "unit": "per 3 lbs"},
-            {"name": "Bananas", "price": 1.99, "store": "Walmart", "category": "fruits", "unit": "per lb"},
-            {"name": "Apples", "price": 2.99, "store": "Walmart", "category": "fruits", "unit": "per lb"},
-            {"name": "Whole Wheat Bread", "price": 2.50, "store": "Walmart", "category": "grains", "unit": "per loaf"},
-            {"name": "Oats", "price": 2.99, "store": "Walmart", "category": "grains", "unit": "per container"},
-            {"name": "Ground Turkey", "price": 4.50, "store": "Walmart", "category": "proteins", "unit": "per lb"},
-            {"name": "Spinach", "price": 2.50, "store": "Walmart", "category": "vegetables", "unit": "per bag"},
-            {"name": "Tomatoes", "price": 2.99, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
-            {"name": "Pasta", "price": 1.99, "store": "Walmart", "category": "grains", "unit": "per box"},
-            {"name": "Canned Tuna", "price": 1.75, "store": "Walmart", "category": "proteins", "unit": "per can"},
-            {"name": "Peanut Butter", "price": 3.50, "store": "Walmart", "category": "proteins", "unit": "per jar"},
-            {"name": "Milk", "price": 4.99, "store": "Walmart", "category": "dairy", "unit": "per gallon"},
-            {"name": "Cheese", "price": 3.99, "store": "Walmart", "category": "dairy", "unit": "per block"},
-            {"name": "Yogurt", "price": 2.99, "store": "Walmart", "category": "dairy", "unit": "per container"},
-            {"name": "Cabbage", "price": 1.99, "store": "Walmart", "category": "vegetables", "unit": "per head"},
-            {"name": "Bell Peppers", "price": 2.50, "store": "Walmart", "category": "vegetables", "unit": "per lb"},
-            {"name": "Garlic", "price": 1.50, "store": "Walmart", "category": "vegetables", "unit": "per bulb"},
-            {"name": "Lentils", "price": 2.25, "store": "Walmart", "category": "proteins", "unit": "per lb"}
-        ]
+        # Shallow copy; the entries are shared like cached API results
+        return list(_MOCK_INGREDIENTS)
@@ -0,0 +1,15 @@
+import orjson
+import os
+
+# Typical prices used when research returns an ingredient without one.
+# Keyed on a word of the ingredient name so identical plans cost the same.
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'price_table.json'), 'rb') as f:
+    _PRICE_TABLE = orjson.loads(f.read())
+
+
+def fallback_price(name: str) -> float:
+    """Look up a deterministic price from the first known word in the name"""
+    for word in name.lower().split():
+        if word in _PRICE_TABLE:
+            return _PRICE_TABLE[word]
+    return _PRICE_TABLE["_default"]
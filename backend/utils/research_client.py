@@ -0,0 +1,17 @@
+import os
+import time
+
+
+def make_research_client():
+    """Return the ingredient research client for the configured provider"""
+    if os.getenv('GROQ_API_KEY', '').strip():
+        try:
+            from utils.openai_research_client import GroqResearchClient
+        except ImportError as e:
+            # The Groq client isn't part of every checkout; research still works through Perplexity
+            print(f"[{time.strftime('%H:%M:%S')}] ⚠️ GROQ_API_KEY is set but the Groq research client is unavailable ({e}); using Perplexity")
+        else:
+            return GroqResearchClient()
+    
+    from utils.perplexity_client import PerplexityClient
+    return PerplexityClient()
@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+import time
+from cachetools import LRUCache
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class SessionStore:
+    """Chat sessions persisted in SQLite so every worker process sees them, with hot sessions kept in memory"""
+    
+    def __init__(self, path: str, dumps: Callable[[Dict], bytes], loads: Callable[[bytes], Dict],
+                 cache_size: int = 1024):
+        self._dumps = dumps
+        self._loads = loads
+        # session_id -> (version, session); the version detects saves made by other workers
+        self._cache = LRUCache(maxsize=cache_size)
+        # session_id -> [version, session, holders] for sessions a request or stream is using,
+        # kept out of LRU eviction so every holder sees the same object
+        self._pinned: Dict[str, List] = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'id TEXT PRIMARY KEY, version INTEGER NOT NULL, data BLOB NOT NULL)'
+        )
+    
+    def _lookup(self, session_id: str) -> Optional[Tuple[int, Dict]]:
+        pinned = self._pinned.get(session_id)
+        if pinned is not None:
+            return pinned[0], pinned[1]
+        return self._cache.get(session_id)
+    
+    def _write(self, session_id: str, data: bytes) -> int:
+        version = time.time_ns()
+        self._db.execute(
+            'INSERT OR REPLACE INTO sessions (id, version, data) VALUES (?, ?, ?)',
+            (session_id, version, data)
+        )
+        return version
+    
+    def _remember(self, session_id: str, version: int, session: Dict, pin: bool):
+        self._cache[session_id] = (version, session)
+        pinned = self._pinned.get(session_id)
+        if pinned is not None:
+            pinned[0], pinned[1] = version, session
+            if pin:
+                pinned[2] += 1
+        elif pin:
+            self._pinned[session_id] = [version, session, 1]
+    
+    def get(self, session_id: str, create: Optional[Callable[[], Dict]] = None, pin: bool = False) -> Optional[Dict]:
+        """Return a session, reloading it if another worker saved a newer copy (blocking I/O)"""
+        with self._lock:
+            row = self._db.execute('SELECT version FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            if row is None:
+                if create is None:
+                    self._cache.pop(session_id, None)
+                    return None
+                # Created under the lock so concurrent first requests agree on one session
+                session = create()
+                version = self._write(session_id, self._dumps(session))
+                self._remember(session_id, version, session, pin)
+                return session
+            
+            cached = self._lookup(session_id)
+            if cached is not None and cached[0] == row[0]:
+                self._remember(session_id, cached[0], cached[1], pin)
+                return cached[1]
+            
+            version, data = self._db.execute(
+                'SELECT version, data FROM sessions WHERE id = ?', (session_id,)
+            ).fetchone()
+            session = self._loads(data)
+            self._remember(session_id, version, session, pin)
+            return session
+    
+    def peek(self, session_id: str) -> Optional[Dict]:
+        """Return the in-memory copy of a session without touching the database"""
+        with self._lock:
+            cached = self._lookup(session_id)
+        return cached[1] if cached is not None else None
+    
+    def put(self, session_id: str, session: Dict, data: Optional[bytes] = None):
+        """Save a session and keep it as the in-memory copy (blocking I/O); `data` may be pre-encoded"""
+        if data is None:
+            data = self._dumps(session)
+        with self._lock:
+            version = self._write(session_id, data)
+            self._remember(session_id, version, session, False)
+    
+    def unpin(self, session_id: str):
+        """Release one hold taken by get with pin=True"""
+        with self._lock:
+            pinned = self._pinned.get(session_id)
+            if pinned is None:
+                return
+            pinned[2] -= 1
+            if not pinned[2]:
+                del self._pinned[session_id]
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._db.close()
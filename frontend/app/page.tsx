@@ -21,6 +21,7 @@ export default function Home() {
   const [activityLog, setActivityLog] = useState<ActivityLog[]>([]);
   const [sessionId] = useState(() => `session_${Date.now()}`);
   const [mealPlan, setMealPlan] = useState<any>(null);
+  const [chatState, setChatState] = useState("");
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const activityLogEndRef = useRef<HTMLDivElement>(null);
   const textareaRef = useRef<HTMLTextAreaElement>(null);
@@ -74,6 +75,10 @@ export default function Home() {
     }
     setIsLoading(true);
 
+    // Answering the confirmation starts meal plan generation inside this request,
+    // so open the stream first to show progress while it runs
+    const source = chatState === "confirm" ? streamActivityLog() : undefined;
+
     try {
       const response = await fetch(`${getBackendUrl()}/api/chat`, {
         method: "POST",
@@ -111,11 +116,8 @@ export default function Home() {
         setMealPlan(data.meal_plan);
       }
 
-      // Start polling immediately when meal plan generation begins
-      // This happens right after user confirms their preferences
-      if (data.ready_for_meal_plan || data.status === "processing") {
-        // Start polling to get real-time activity log updates
-        pollActivityLog();
+      if (data.state) {
+        setChatState(data.state);
       }
     } catch (error) {
       console.error("Error:", error);
@@ -127,10 +129,74 @@ export default function Home() {
       };
       setMessages((prev) => [...prev, errorMessage]);
     } finally {
+      // The response carries the full log, so the stream is done either way
+      source?.close();
       setIsLoading(false);
     }
   };
 
+  const streamActivityLog = (): EventSource | undefined => {
+    // Fall back to polling where Server-Sent Events are unavailable
+    if (typeof EventSource === "undefined") {
+      pollActivityLog();
+      return;
+    }
+
+    const source = new EventSource(
+      `${getBackendUrl()}/api/activity_log/stream?session_id=${sessionId}`
+    );
+
+    // Full log sent once on connect, then individual entries as they are added
+    source.addEventListener("snapshot", (event) => {
+      const entries: string[] = JSON.parse((event as MessageEvent).data);
+      setActivityLog(
+        entries.map((msg: string) => ({
+          message: msg,
+          timestamp: new Date(),
+        }))
+      );
+    });
+
+    source.addEventListener("log", (event) => {
+      const msg: string = JSON.parse((event as MessageEvent).data);
+      setActivityLog((prev) => [...prev, { message: msg, timestamp: new Date() }]);
+    });
+
+    // Bursts of entries written together arrive as one event
+    source.addEventListener("logs", (event) => {
+      const entries: string[] = JSON.parse((event as MessageEvent).data);
+      setActivityLog((prev) => [
+        ...prev,
+        ...entries.map((msg: string) => ({
+          message: msg,
+          timestamp: new Date(),
+        })),
+      ]);
+    });
+
+    // Stop streaming when complete or error; the status sent on connect may be
+    // left over from an earlier plan, so only react once this run has started
+    let started = false;
+    source.addEventListener("status", (event) => {
+      const status: string = JSON.parse((event as MessageEvent).data);
+      if (status === "processing") {
+        started = true;
+      } else if (started && (status === "complete" || status === "error")) {
+        source.close();
+      }
+    });
+
+    source.onerror = () => {
+      console.error("Activity log stream failed, falling back to polling");
+      source.close();
+      pollActivityLog();
+    };
+
+    // Stop streaming after 2 minutes (should be enough for meal plan generation)
+    setTimeout(() => source.close(), 120000);
+    return source;
+  };
+
   const pollActivityLog = async () => {
     const interval = setInterval(async () => {
       try {
@@ -215,8 +281,8 @@ export default function Home() {
         setMealPlan(data.meal_plan);
       }
 
-      if (data.ready_for_meal_plan) {
-        pollActivityLog();
+      if (data.state) {
+        setChatState(data.state);
       }
     } catch (error) {
       console.error("Error:", error);